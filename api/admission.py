@@ -0,0 +1,156 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from metrics import span, ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+# Admission control for work that ends at a rate-limited provider. Each budget admits a
+# fixed number of requests at a time; the next few wait in a bounded FIFO queue for at
+# most a few seconds, and anything beyond that is turned away at once with 429 and a
+# Retry-After estimate, so overload shows up as quick rejections instead of every
+# request slowing down together.
+#
+#   chat:<model>   /chat and /chat/stream, per model, e.g. CHAT_CONCURRENCY="gpt-4o=8,gpt-4o-mini=32"
+#                  (models not listed get CHAT_CONCURRENCY_DEFAULT)
+#   batch          whole /chat/batch requests, which then run CHAT_BATCH_CONCURRENCY
+#                  generations each
+#   ingest         /upload-doc: at most INGEST_QUEUE_LIMIT documents waiting for an
+#                  ingest worker (see ingest_jobs.py)
+#
+# The budgets are separate, so a bulk upload or an evaluation batch cannot take the
+# slots interactive chat needs.
+
+
+def _parse_concurrency(spec):
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, limit = item.partition("=")
+        limits[model.strip()] = int(limit)
+    return limits
+
+CHAT_CONCURRENCY = _parse_concurrency(os.getenv("CHAT_CONCURRENCY", ""))
+CHAT_CONCURRENCY_DEFAULT = int(os.getenv("CHAT_CONCURRENCY_DEFAULT", "16"))
+CHAT_QUEUE_LIMIT = int(os.getenv("CHAT_QUEUE_LIMIT", "64"))            # waiting requests per model
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "10"))      # seconds before giving up
+CHAT_BATCH_REQUESTS = int(os.getenv("CHAT_BATCH_REQUESTS", "2"))
+CHAT_BATCH_QUEUE_LIMIT = int(os.getenv("CHAT_BATCH_QUEUE_LIMIT", "4"))
+INGEST_QUEUE_LIMIT = int(os.getenv("INGEST_QUEUE_LIMIT", "20"))
+INGEST_RETRY_AFTER = int(os.getenv("INGEST_RETRY_AFTER", "30"))
+MAX_RETRY_AFTER = 60
+
+
+class Overloaded(Exception):
+    # Answered with 429 and a Retry-After header (see main.py)
+    def __init__(self, budget, reason, retry_after):
+        super().__init__(f"Too many requests for {budget} ({reason}), retry in {retry_after}s")
+        self.budget = budget
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _reject(budget, reason, retry_after):
+    ADMISSION_REJECTED.labels(budget, reason).inc()
+    return Overloaded(budget, reason, max(1, min(MAX_RETRY_AFTER, math.ceil(retry_after))))
+
+
+class AdmissionController:
+    # An asyncio semaphore with a bounded, time-limited FIFO queue. A released slot is
+    # handed straight to the oldest waiter, so newcomers cannot overtake the queue.
+    # Lives on the event loop, so no locking is needed.
+
+    def __init__(self, budget, limit, max_queue, max_wait):
+        self.budget = budget
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._active = 0
+        self._waiters = deque()
+        self._hold_seconds = 1.0        # moving average of how long a slot is held
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def _gauges(self):
+        ADMISSION_IN_FLIGHT.labels(self.budget).set(self._active)
+        ADMISSION_QUEUE_DEPTH.labels(self.budget).set(len(self._waiters))
+
+    def retry_after(self):
+        # Time for the slots to work through the queue ahead of a new request
+        return self._hold_seconds * (len(self._waiters) + 1) / self.limit
+
+    async def acquire(self):
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            self._gauges()
+            ADMISSION_WAIT_SECONDS.labels(self.budget).observe(0.0)
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise _reject(self.budget, "queue_full", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self._gauges()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return      # a slot was handed over as time ran out
+            raise _reject(self.budget, "queue_timeout", self.retry_after()) from None
+        except asyncio.CancelledError:
+            # The caller went away just as a slot was handed over: pass it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            if future in self._waiters:
+                self._waiters.remove(future)
+            self._gauges()
+            ADMISSION_WAIT_SECONDS.labels(self.budget).observe(time.perf_counter() - start)
+
+    def release(self):
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                self._gauges()
+                return
+        self._active -= 1
+        self._gauges()
+
+    @asynccontextmanager
+    async def admit(self):
+        with span("admission"):
+            await self.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * (time.perf_counter() - start)
+            self.release()
+
+
+_chat_controllers = {}
+
+
+def chat_admission(model):
+    controller = _chat_controllers.get(model)
+    if controller is None:
+        controller = AdmissionController(f"chat:{model}", CHAT_CONCURRENCY.get(model, CHAT_CONCURRENCY_DEFAULT),
+                                         CHAT_QUEUE_LIMIT, CHAT_QUEUE_TIMEOUT)
+        _chat_controllers[model] = controller
+    return controller
+
+
+batch_admission = AdmissionController("batch", CHAT_BATCH_REQUESTS, CHAT_BATCH_QUEUE_LIMIT, CHAT_QUEUE_TIMEOUT)
+
+
+def admit_ingest(backlog):
+    # backlog: documents submitted but not yet picked up by an ingest worker. Running
+    # jobs are already bounded by INGEST_WORKERS, apart from the chat budgets.
+    if backlog >= INGEST_QUEUE_LIMIT:
+        raise _reject("ingest", "queue_full", INGEST_RETRY_AFTER)
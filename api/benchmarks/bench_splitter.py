@@ -0,0 +1,64 @@
+# Compares the old RecursiveCharacterTextSplitter (tiktoken length_function) with the
+# single-pass TokenOffsetSplitter on the workshop PDFs.
+#
+#   python benchmarks/bench_splitter.py [folder] [--repeat N]
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import tiktoken
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from token_splitter import TokenOffsetSplitter, DEFAULT_SEPARATORS
+
+DOCUMENTS_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "Documents")
+
+
+def best_time(fn, repeat):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the chunking text splitters.")
+    parser.add_argument("folder", nargs="?", default=DOCUMENTS_DIR)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    encoding = tiktoken.get_encoding("cl100k_base")
+    pages = []
+    for path in sorted(glob.glob(os.path.join(args.folder, "*.pdf"))):
+        pages.extend(PyPDFLoader(path).load())
+    # One long document as well, to show how each splitter scales with text length
+    long_doc = [type(pages[0])(page_content="\n".join(p.page_content for p in pages))]
+
+    splitters = {
+        "recursive": RecursiveCharacterTextSplitter(
+            chunk_size=300, chunk_overlap=50, separators=DEFAULT_SEPARATORS,
+            length_function=lambda txt: len(encoding.encode(txt)),
+        ),
+        "token_offset": TokenOffsetSplitter(encoding, chunk_size=300, chunk_overlap=50),
+    }
+
+    chars = sum(len(p.page_content) for p in pages)
+    print(f"{len(pages)} pages, {chars:,} characters\n")
+    print(f"{'splitter':<14}{'input':<10}{'seconds':>10}{'chunks':>8}{'max tok':>9}{'avg tok':>9}")
+    for label, docs in (("pages", pages), ("one doc", long_doc)):
+        for name, splitter in splitters.items():
+            seconds, chunks = best_time(lambda: splitter.split_documents(docs), args.repeat)
+            sizes = [len(encoding.encode(c.page_content)) for c in chunks]
+            print(f"{name:<14}{label:<10}{seconds:>10.3f}{len(chunks):>8}"
+                  f"{max(sizes):>9}{sum(sizes) / len(sizes):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
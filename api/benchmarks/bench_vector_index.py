@@ -0,0 +1,100 @@
+# Compares top-k retrieval through Chroma (HNSW) with the in-memory MatryoshkaIndex
+# (256-dim prefix search + full-dimension rerank) on the same vectors.
+#
+#   python benchmarks/bench_vector_index.py [--chunks N] [--queries Q] [--chroma-dir ./chroma_db]
+#
+# Without --chroma-dir a synthetic corpus is generated whose variance decays across the
+# dimensions, like Matryoshka-trained embeddings; with it, the vectors stored in that
+# Chroma collection are used. Queries are perturbed copies of corpus vectors, and recall
+# is measured against an exact float32 brute-force search.
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import chromadb
+import numpy as np
+
+from vector_index import MatryoshkaIndex
+
+
+def synthetic_corpus(n, dim, rng):
+    scale = 1 / np.sqrt(1 + np.arange(dim) / 64)
+    return (rng.standard_normal((n, dim)) * scale).astype(np.float32)
+
+
+def exact_top_k(corpus, queries, k):
+    corpus = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    return np.argsort(-(queries @ corpus.T), axis=1)[:, :k]
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000
+
+
+def run(label, search, queries, ids, truth, k):
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(query)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(found) & {ids[i] for i in expected})
+    print(f"{label:<22}{percentile_ms(latencies, 50):>9.2f}{percentile_ms(latencies, 95):>9.2f}"
+          f"{hits / (len(queries) * k):>10.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Chroma vs the in-memory vector index.")
+    parser.add_argument("--chunks", type=int, default=10_000)
+    parser.add_argument("--dim", type=int, default=3072)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--noise", type=float, default=0.5, help="query perturbation, relative to the vector norm")
+    parser.add_argument("--chroma-dir", help="use the vectors of an existing Chroma collection")
+    args = parser.parse_args(argv)
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.chroma_dir:
+            collection = chromadb.PersistentClient(path=args.chroma_dir).get_collection("langchain")
+            data = collection.get(include=["embeddings", "metadatas"])
+            ids, corpus = data["ids"], np.asarray(data["embeddings"], dtype=np.float32)
+        else:
+            corpus = synthetic_corpus(args.chunks, args.dim, rng)
+            ids = [f"chunk-{i}" for i in range(len(corpus))]
+            collection = chromadb.PersistentClient(path=os.path.join(tmp, "chroma")).create_collection(
+                "bench", metadata={"hnsw:space": "cosine"})
+            print(f"Loading {len(ids)} vectors into Chroma ...")
+            for start in range(0, len(ids), 5000):
+                collection.add(ids=ids[start:start + 5000], embeddings=corpus[start:start + 5000],
+                               metadatas=[{"file_id": 0}] * len(ids[start:start + 5000]))
+
+        picks = rng.integers(0, len(corpus), args.queries)
+        noise = rng.standard_normal((args.queries, corpus.shape[1])).astype(np.float32)
+        noise *= args.noise * np.linalg.norm(corpus[picks], axis=1, keepdims=True) / np.sqrt(corpus.shape[1])
+        queries = corpus[picks] + noise
+        truth = exact_top_k(corpus, queries, args.k)
+
+        print(f"{len(ids)} vectors x {corpus.shape[1]} dims, {args.queries} queries, k={args.k}\n")
+        print(f"{'backend':<22}{'p50 ms':>9}{'p95 ms':>9}{'recall':>10}")
+        run("chroma (hnsw)", lambda q: collection.query(query_embeddings=[q], n_results=args.k,
+                                                        include=[])["ids"][0],
+            queries, ids, truth, args.k)
+
+        for dtype in ("float16", "int8"):
+            index = MatryoshkaIndex(path=os.path.join(tmp, dtype), dtype=dtype)
+            index.add(ids, corpus, [0] * len(ids))
+            index.save()
+            run(f"memory ({dtype})", lambda q: [cid for cid, _ in index.search(q, args.k)],
+                queries, ids, truth, args.k)
+            mapped = sum(os.path.getsize(os.path.join(tmp, dtype, f"{name}.npy")) for name, _ in index._segments)
+            print(f"{'':<22}resident prefix {index._prefix.nbytes / 2**20:.1f} MiB, "
+                  f"mapped full vectors {mapped / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
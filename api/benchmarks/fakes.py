@@ -0,0 +1,54 @@
+# Deterministic, offline stand-ins for OpenAIEmbeddings and ChatOpenAI used by the
+# benchmark suite. Same text in, same vector out; no network and no model time.
+import hashlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+FAKE_ANSWER = (
+    "If your business stops when you are not there, that is a system problem. "
+    "Build structure, not dependency. Let's start fixing that."
+)
+
+
+class FakeEmbeddings(Embeddings):
+    # Unit vectors seeded from a hash of the text; counts calls so batching can be measured
+
+    def __init__(self, dim=3072):
+        self.dim = dim
+        self.calls = 0
+        self.inputs = 0
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts, chunk_size=None):
+        self.calls += 1
+        self.inputs += len(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class FakeChatModel(FakeListChatModel):
+    # Answers every prompt with the same text, instantly
+
+    def __init__(self, **kwargs):
+        super().__init__(responses=[FAKE_ANSWER])
+
+
+def fake_chat_openai(**kwargs):
+    # Drop-in for the ChatOpenAI(model=..., temperature=..., http_client=...) constructor
+    return FakeChatModel()
+
+
+def install(chroma_utils, langchain_utils, dim=3072):
+    # Points the already-imported modules at the fakes; returns the fake embedder
+    embeddings = FakeEmbeddings(dim)
+    chroma_utils.get_embedding_function().embeddings = embeddings
+    langchain_utils.ChatOpenAI = fake_chat_openai
+    return embeddings
@@ -0,0 +1,235 @@
+# Offline micro-benchmark suite. Runs the real pipeline components against the PDFs in
+# Documents/ with a deterministic fake embedder and chat model (benchmarks/fakes.py),
+# in a scratch directory, and writes the results as JSON.
+#
+#   python benchmarks/run_benchmarks.py [--output results.json] [--baseline previous.json]
+#
+# Measured:
+#   split     load_document / load_and_split_document throughput
+#   embedding CachedEmbeddings in INDEX_BATCH_SIZE batches, cold and fully cached
+#   chroma    index_document_to_chroma per file, similarity_search latency
+#   history   insert_application_logs + get_chat_history round-trips
+#   chat      POST /chat end to end, i.e. everything except model time
+#
+# The semantic cache and verbatim fast path are switched off so every /chat request
+# runs the whole retrieval + generation chain.
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+API_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DOCUMENTS_DIR = os.path.join(API_DIR, "..", "Documents")
+sys.path.insert(0, API_DIR)
+
+
+def timings(samples):
+    ms = np.asarray(samples) * 1000
+    return {
+        "n": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def bench_split(chroma_utils, files):
+    load_seconds, split_seconds, pages, chunks = 0.0, 0.0, 0, []
+    for path in files:
+        seconds, documents = timed(chroma_utils.load_document, path)
+        load_seconds += seconds
+        pages += len(documents)
+        seconds, splits = timed(chroma_utils.load_and_split_document, path)
+        split_seconds += seconds
+        chunks.extend(splits)
+    return {
+        "files": len(files),
+        "pages": pages,
+        "chunks": len(chunks),
+        "load_seconds": round(load_seconds, 4),
+        "load_and_split_seconds": round(split_seconds, 4),
+        "chunks_per_second": round(len(chunks) / split_seconds, 1),
+    }, chunks
+
+
+def bench_embedding(chroma_utils, fake, texts, scratch):
+    from embedding_cache import CachedEmbeddings
+
+    batch = chroma_utils.INDEX_BATCH_SIZE
+    cache = CachedEmbeddings(fake, model="fake", path=os.path.join(scratch, "embedding_bench.db"))
+    result = {"chunks": len(texts), "batch_size": batch}
+    for label in ("cold", "warm"):
+        calls = fake.calls
+        start = time.perf_counter()
+        for i in range(0, len(texts), batch):
+            cache.embed_documents(texts[i:i + batch])
+        seconds = time.perf_counter() - start
+        result[f"{label}_seconds"] = round(seconds, 4)
+        result[f"{label}_model_calls"] = fake.calls - calls
+        result[f"{label}_chunks_per_second"] = round(len(texts) / seconds, 1)
+    return result
+
+
+def bench_chroma(chroma_utils, db_utils, files, questions):
+    index_samples = []
+    for path in files:
+        file_id = db_utils.insert_document_record(os.path.basename(path))
+        seconds, ok = timed(chroma_utils.index_document_to_chroma, path, file_id)
+        if not ok:
+            raise RuntimeError(f"indexing {path} failed")
+        index_samples.append(seconds)
+    chunks = chroma_utils.get_vectorstore()._collection.count()
+    query_samples = [timed(chroma_utils.get_vectorstore().similarity_search, q, k=3)[0] for q in questions]
+    return {
+        "chunks": chunks,
+        "index_seconds": round(sum(index_samples), 4),
+        "index_chunks_per_second": round(chunks / sum(index_samples), 1),
+        "index_per_file": timings(index_samples),
+        "query": timings(query_samples),
+    }
+
+
+def bench_history(db_utils, rounds, turns):
+    insert_samples, read_samples = [], []
+    for _ in range(rounds):
+        session_id = str(uuid.uuid4())
+        for turn in range(turns):
+            seconds, _ = timed(db_utils.insert_application_logs, session_id, f"question {turn}",
+                               f"answer {turn}", "gpt-4o-mini")
+            insert_samples.append(seconds)
+            seconds, history = timed(db_utils.get_chat_history, session_id)
+            read_samples.append(seconds)
+            assert len(history) == 2 * (turn + 1)
+    db_utils.log_writer.flush()
+    return {"insert": timings(insert_samples), "get_chat_history": timings(read_samples)}
+
+
+def bench_chat(main, questions, turns):
+    from fastapi.testclient import TestClient
+
+    samples = []
+    with TestClient(main.app) as client:
+        client.post("/chat", json={"question": questions[0]})     # warm-up
+        for i in range(0, len(questions), turns):
+            session_id = None
+            for question in questions[i:i + turns]:
+                payload = {"question": question, "model": "gpt-4o-mini"}
+                if session_id:
+                    payload["session_id"] = session_id
+                seconds, response = timed(client.post, "/chat", json=payload)
+                response.raise_for_status()
+                session_id = response.json()["session_id"]
+                samples.append(seconds)
+    return {"turns_per_session": turns, "request": timings(samples)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, prefix=""):
+    # Prints every numeric metric that is present in both runs with its relative change
+    for key, value in results.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            compare(value, old or {}, f"{name}.")
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            print(f"  {name:<45}{old:>12.3f} -> {value:>12.3f}  {(value - old) / old:+.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite.")
+    parser.add_argument("--documents", default=DOCUMENTS_DIR, help="folder of PDFs to use as the corpus")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=3072, help="fake embedding dimensions")
+    parser.add_argument("--keep-scratch", action="store_true")
+    args = parser.parse_args(argv)
+
+    files = sorted(glob.glob(os.path.join(os.path.abspath(args.documents), "*.pdf")))
+    if not files:
+        parser.error(f"no PDFs in {args.documents}")
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    # Every store the pipeline touches goes to a scratch directory
+    scratch = tempfile.mkdtemp(prefix="rag-bench-")
+    os.environ.update({
+        "RAG_DB_PATH": os.path.join(scratch, "rag_app.db"),
+        "CHROMA_PERSIST_DIR": os.path.join(scratch, "chroma_db"),
+        "EMBEDDING_CACHE_PATH": os.path.join(scratch, "embedding_cache.db"),
+        "VECTOR_INDEX_DIR": os.path.join(scratch, "vector_index"),
+        "SEMANTIC_CACHE_ENABLED": "0",
+        "VERBATIM_FAST_PATH": "0",
+    })
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    os.chdir(scratch)
+
+    import chroma_utils
+    import db_utils
+    import langchain_utils
+    import main as api_main
+    from benchmarks import fakes
+
+    fake = fakes.install(chroma_utils, langchain_utils, dim=args.dim)
+    try:
+        results = {}
+        results["split"], chunks = bench_split(chroma_utils, files)
+        results["embedding"] = bench_embedding(chroma_utils, fakes.FakeEmbeddings(args.dim),
+                                               [c.page_content for c in chunks], scratch)
+        rng = random.Random(0)
+        questions = [" ".join(c.page_content.split()[:12]) for c in rng.sample(chunks, args.queries)]
+        results["chroma"] = bench_chroma(chroma_utils, db_utils, files, questions)
+        results["history"] = bench_history(db_utils, rounds=20, turns=10)
+        results["chat"] = bench_chat(api_main, questions, turns=5)
+        fake_calls = fake.calls
+    finally:
+        db_utils.log_writer.stop()
+        if not args.keep_scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"documents": len(files), "queries": args.queries, "embedding_dim": args.dim,
+                   "fake_embedding_calls": fake_calls},
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"\nWrote {output}")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        print(f"\nChange vs {args.baseline} (commit {baseline.get('commit')}):")
+        compare(results, baseline.get("results", {}))
+
+
+if __name__ == "__main__":
+    main()
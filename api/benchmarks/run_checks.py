@@ -0,0 +1,264 @@
+# Offline regression checks for behaviour that is hard to see from the outside. Like the
+# benchmark suite, they run the real API against the PDFs in Documents/ with the fakes
+# from benchmarks/fakes.py, in a scratch directory.
+#
+#   python benchmarks/run_checks.py [name ...]
+#
+# Prints one line per check and exits non-zero if any failed.
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+API_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DOCUMENTS_DIR = os.path.join(API_DIR, "..", "Documents")
+sys.path.insert(0, API_DIR)
+
+CHECKS = {}
+
+
+def check(fn):
+    CHECKS[fn.__name__.removeprefix("check_")] = fn
+    return fn
+
+
+def document(name):
+    return os.path.join(DOCUMENTS_DIR, name)
+
+
+def sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class Env:
+    # The modules under test and a TestClient for the API, shared by the checks
+
+    def __init__(self, client, chroma_utils, db_utils, fake):
+        self.client = client
+        self.chroma_utils = chroma_utils
+        self.db_utils = db_utils
+        self.fake = fake
+
+    def upload(self, path, filename):
+        with open(path, "rb") as f:
+            response = self.client.post("/upload-doc", files={"file": (filename, f, "application/pdf")})
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    def wait(self, job_id, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.client.get(f"/jobs/{job_id}").json()
+            if job["status"] not in ("pending", "indexing"):
+                return job
+            time.sleep(0.05)
+        raise AssertionError(f"job {job_id} did not finish")
+
+    def record(self, file_id):
+        return next(doc for doc in self.db_utils.get_all_documents() if doc["id"] == file_id)
+
+    def content_hash(self, file_id):
+        conn = self.db_utils.get_db_connection()
+        return conn.execute("SELECT content_hash FROM document_store WHERE id = ?", (file_id,)).fetchone()[0]
+
+    def chunks(self, file_id):
+        return self.chroma_utils.document_chunk_count(file_id)
+
+
+class BlockingEmbeddings:
+    # Stands in for the fake embedder: every call waits until released, then raises
+    # `error` if one is set
+    def __init__(self, embeddings, error=None):
+        self.embeddings = embeddings
+        self.error = error
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def embed_documents(self, texts):
+        self.entered.set()
+        self.release.wait()
+        if self.error:
+            raise self.error
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+
+def _interrupted_reupload(env, filename, interrupt):
+    # Indexes one version of `filename`, then re-uploads another and interrupts its job
+    # mid-embedding: the record, file and chunks of the first version must be untouched
+    first, second = document("BMI Intro 2024.pdf"), document("BMI 2025 Day-1.pdf")
+    job = env.upload(first, filename)
+    assert env.wait(job["job_id"])["status"] == "indexed"
+    file_id = job["file_id"]
+    chunks = env.chunks(file_id)
+
+    cached = env.chroma_utils.get_embedding_function()
+    blocking = BlockingEmbeddings(cached.embeddings, error=RuntimeError("provider down") if interrupt == "fail" else None)
+    cached.embeddings = blocking
+    try:
+        job = env.upload(second, filename)
+        assert blocking.entered.wait(30), "the re-upload never reached the embedding stage"
+        if interrupt == "cancel":
+            assert env.client.post(f"/jobs/{job['job_id']}/cancel").json()["cancelled"]
+        blocking.release.set()
+        status = env.wait(job["job_id"])["status"]
+    finally:
+        cached.embeddings = blocking.embeddings
+    assert status == ("cancelled" if interrupt == "cancel" else "failed"), status
+
+    record = env.record(file_id)
+    assert record["status"] == "indexed", record
+    assert record["chunk_count"] == chunks, record
+    assert env.content_hash(file_id) == sha256(first)
+    assert env.chunks(file_id) == chunks
+    assert sha256(os.path.join("uploaded_docs", filename)) == sha256(first)
+    assert not [name for name in os.listdir("uploaded_docs") if name.startswith(".")], "staged file left behind"
+
+    # The next upload of the first version is recognised as unchanged
+    assert env.upload(first, filename)["job_id"] is None
+
+
+@check
+def check_reupload_cancelled(env):
+    _interrupted_reupload(env, "cancelled.pdf", "cancel")
+
+
+@check
+def check_reupload_failed(env):
+    _interrupted_reupload(env, "failed.pdf", "fail")
+
+
+@check
+def check_reupload_indexed(env):
+    # A re-upload that succeeds replaces the record's hash and the stored file
+    first, second = document("BMI Intro 2024.pdf"), document("BMI 2025 Day 3.pdf")
+    job = env.upload(first, "replaced.pdf")
+    assert env.wait(job["job_id"])["status"] == "indexed"
+    file_id = job["file_id"]
+    job = env.upload(second, "replaced.pdf")
+    assert env.wait(job["job_id"])["status"] == "indexed"
+    assert env.content_hash(file_id) == sha256(second)
+    assert sha256(os.path.join("uploaded_docs", "replaced.pdf")) == sha256(second)
+    assert env.record(file_id)["chunk_count"] == env.chunks(file_id) > 0
+
+
+@check
+def check_chat_embeds_question_once(env):
+    # An uncached question is embedded for the semantic cache lookup and that vector is
+    # reused for retrieval, whatever the retriever configuration
+    import langchain_utils
+    job = env.upload(document("BMI 2025 Day 4.pdf"), "chat.pdf")
+    assert env.wait(job["job_id"])["status"] == "indexed"
+    defaults = dict(langchain_utils.retriever_config)
+    try:
+        for n, config in enumerate([{}, {"backend": "memory"}, {"hybrid": False}, {"token_budget": 0}]):
+            langchain_utils.set_retriever_config(**{**defaults, **config})
+            for path in ("/chat", "/chat/stream"):
+                calls = env.fake.calls
+                response = env.client.post(path, json={"question": f"What is step {n} of {path}?"})
+                assert response.status_code == 200, response.text
+                assert env.fake.calls - calls == 1, f"{config} {path}: {env.fake.calls - calls} embedding calls"
+    finally:
+        langchain_utils.set_retriever_config(**defaults)
+
+
+class RecordingEmbeddingsClient:
+    # Stands in for the OpenAI client behind OpenAIEmbeddings; records the inputs (token
+    # lists) of every request it receives
+    def __init__(self, dim):
+        self.dim = dim
+        self.requests = []
+
+    def create(self, input, **kwargs):
+        self.requests.append(input)
+        return {"data": [{"embedding": [1.0] + [0.0] * (self.dim - 1)} for _ in input]}
+
+
+@check
+def check_bulk_embedding_requests(env):
+    # The batches bulk_ingest.py budgets are the requests OpenAIEmbeddings really sends:
+    # one per batch, within the token budget, even beyond its own 1000-input chunk_size
+    import bulk_ingest
+    from langchain_openai import OpenAIEmbeddings
+    client = RecordingEmbeddingsClient(env.fake.dim)
+    openai = OpenAIEmbeddings(model=env.chroma_utils.EMBEDDING_MODEL, api_key="offline-checks")
+    openai.client = client
+    cached = env.chroma_utils.get_embedding_function()
+    original, cached.embeddings = cached.embeddings, openai
+    file_id = 10 ** 6
+    try:
+        for budget in (2000, 10 ** 7):
+            client.requests.clear()
+            nonce = uuid.uuid4().hex
+            chunks = [(f"{nonce} chunk {i}: " + "lorem ipsum " * 10, {"page_key": f"{nonce}:0"}) for i in range(1500)]
+            done = []
+            writer = bulk_ingest.ChunkWriter(env.chroma_utils.get_vectorstore(), cached, env.chroma_utils.get_encoding(),
+                                             budget, 500, lambda path, chunk_count: done.append(chunk_count))
+            writer.add_file("synthetic", file_id, chunks)
+            writer.flush()
+            sizes = [len(request) for request in client.requests]
+            tokens = [sum(len(text) for text in request) for request in client.requests]
+            assert done == [len(chunks)], done
+            assert sum(sizes) == len(chunks), sizes
+            assert len(sizes) == writer.embed_calls, f"budget {budget}: {writer.embed_calls} batches sent as {sizes}"
+            assert max(tokens) <= budget, f"budget {budget}: requests of {max(tokens)} tokens"
+    finally:
+        cached.embeddings = original
+        env.chroma_utils.delete_doc_from_chroma(file_id)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline regression checks.")
+    parser.add_argument("names", nargs="*", help=f"checks to run (default: all of {', '.join(CHECKS)})")
+    parser.add_argument("--dim", type=int, default=64, help="fake embedding dimensions")
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(CHECKS)
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(sorted(unknown))}")
+
+    scratch = tempfile.mkdtemp(prefix="rag-checks-")
+    os.environ.update({
+        "RAG_DB_PATH": os.path.join(scratch, "rag_app.db"),
+        "CHROMA_PERSIST_DIR": os.path.join(scratch, "chroma_db"),
+        "EMBEDDING_CACHE_PATH": os.path.join(scratch, "embedding_cache.db"),
+        "VECTOR_INDEX_DIR": os.path.join(scratch, "vector_index"),
+    })
+    os.environ.setdefault("OPENAI_API_KEY", "offline-checks")
+    os.chdir(scratch)
+
+    import chroma_utils
+    import db_utils
+    import langchain_utils
+    import main as api_main
+    from fastapi.testclient import TestClient
+    from benchmarks import fakes
+
+    fake = fakes.install(chroma_utils, langchain_utils, dim=args.dim)
+    failed = 0
+    try:
+        with TestClient(api_main.app) as client:
+            env = Env(client, chroma_utils, db_utils, fake)
+            for name in args.names or CHECKS:
+                try:
+                    CHECKS[name](env)
+                except Exception as e:
+                    failed += 1
+                    print(f"FAIL {name}: {type(e).__name__}: {e}")
+                else:
+                    print(f"ok   {name}")
+    finally:
+        db_utils.log_writer.stop()
+        shutil.rmtree(scratch, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+# Bulk-index a whole folder (e.g. ../Documents) into Chroma without going through /upload-doc.
+#
+#   python bulk_ingest.py ../Documents --workers 4
+#
+# PDFs are parsed and split in a process pool, chunks from all files are embedded in
+# batches sized by a token budget, and Chroma writes are grouped into large upserts.
+# Progress is checkpointed to a state file so an interrupted run picks up where it left off.
+#
+# Files are recorded under their path relative to the folder ("a.pdf", "sub/a.pdf"), the
+# same names /upload-doc uses for top-level files: a file that is already indexed with the
+# same content is skipped, and a changed one keeps its file_id. A running server picks up
+# the new chunks through the corpus generation published after each file.
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from db_utils import (
+    insert_document_record, update_document_status, find_document_by_filename, update_document_upload
+)
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.html')
+DEFAULT_STATE_FILE = "bulk_ingest_state.json"
+# The embeddings endpoint accepts at most 2048 inputs and ~300k tokens per request
+MAX_EMBED_INPUTS = 2048
+
+
+def _parse(path):
+    # Runs in a worker process
+    from chroma_utils import load_and_split_document
+    return [(split.page_content, split.metadata) for split in load_and_split_document(path)]
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load_state(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"files": {}}
+
+
+def _save_state(state, path):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+class ChunkWriter:
+    # Buffers chunks across files: embeds them in token-budgeted batches and writes
+    # the results to Chroma in large upserts. Calls on_file_done(path, chunk_count) once
+    # every chunk of a file has been written.
+
+    def __init__(self, vectorstore, embeddings, encoding, token_budget, write_batch, on_file_done):
+        self.collection = vectorstore._collection
+        self.embeddings = embeddings
+        self.encoding = encoding
+        self.token_budget = token_budget
+        self.write_batch = write_batch
+        self.on_file_done = on_file_done
+        self.to_embed, self.to_embed_tokens = [], 0
+        self.to_write = []
+        self.remaining = {}     # path -> chunks not yet written
+        self.chunk_counts = {}  # path -> chunks of the file
+        self.embed_calls = 0
+        self.cache_counts = Counter()
+
+    def add_file(self, path, file_id, chunks):
+        from chroma_utils import chunk_id
+        if not chunks:
+            self.on_file_done(path, 0)
+            return
+        self.remaining[path] = self.chunk_counts[path] = len(chunks)
+        per_page = Counter()
+        for text, metadata in chunks:
+            n = per_page[metadata["page_key"]]
+            per_page[metadata["page_key"]] += 1
+            tokens = len(self.encoding.encode(text))
+            if self.to_embed and (self.to_embed_tokens + tokens > self.token_budget
+                                  or len(self.to_embed) >= MAX_EMBED_INPUTS):
+                self._embed()
+            self.to_embed.append((path, chunk_id(file_id, metadata["page_key"], n), text,
+                                  {**metadata, "file_id": file_id}))
+            self.to_embed_tokens += tokens
+
+    def _embed(self):
+        # One provider request per budgeted batch: the batch size is passed as chunk_size,
+        # so OpenAIEmbeddings does not split it again by its own input count
+        texts = [text for _, _, text, _ in self.to_embed]
+        vectors = self.embeddings.embed_documents(texts, counts=self.cache_counts, chunk_size=len(texts))
+        self.embed_calls += 1
+        self.to_write.extend(
+            (path, cid, text, metadata, vector)
+            for (path, cid, text, metadata), vector in zip(self.to_embed, vectors)
+        )
+        self.to_embed, self.to_embed_tokens = [], 0
+        while len(self.to_write) >= self.write_batch:
+            self._write(self.to_write[:self.write_batch])
+            self.to_write = self.to_write[self.write_batch:]
+
+    def _write(self, rows):
+        self.collection.upsert(
+            ids=[row[1] for row in rows],
+            documents=[row[2] for row in rows],
+            metadatas=[row[3] for row in rows],
+            embeddings=[row[4] for row in rows],
+        )
+        for path, *_ in rows:
+            self.remaining[path] -= 1
+            if self.remaining[path] == 0:
+                del self.remaining[path]
+                self.on_file_done(path, self.chunk_counts.pop(path))
+
+    def flush(self):
+        if self.to_embed:
+            self._embed()
+        if self.to_write:
+            self._write(self.to_write)
+            self.to_write = []
+
+
+def bulk_ingest(folder, workers, token_budget, write_batch, state_path, upload_dir="uploaded_docs"):
+    from chroma_utils import (
+        get_vectorstore, get_embedding_function, get_encoding, delete_doc_from_chroma, bump_corpus_version
+    )
+    embedding_function = get_embedding_function()
+
+    state = _load_state(state_path)
+    files = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(folder)
+        for name in names
+        if name.lower().endswith(SUPPORTED_EXTENSIONS)
+    )
+
+    # Register every file that still needs work; files already indexed with the same
+    # content (by an earlier run or through /upload-doc) are skipped
+    todo, busy = {}, []
+    for path in files:
+        key = os.path.abspath(path)
+        filename = os.path.relpath(path, folder).replace(os.sep, "/")
+        content_hash = _file_hash(path)
+        entry = state["files"].get(key)
+        if entry and entry["sha256"] == content_hash and entry["status"] == "indexed":
+            continue
+        existing = find_document_by_filename(filename)
+        if existing and existing["status"] == "indexed" and existing["content_hash"] == content_hash:
+            state["files"][key] = {"file_id": existing["id"], "sha256": content_hash, "status": "indexed"}
+            continue
+        if existing and existing["status"] in ("pending", "indexing") and not entry:
+            # An /upload-doc job is indexing it right now
+            busy.append(filename)
+            continue
+        if existing:
+            # Interrupted or changed since it was indexed: drop whatever was written for it
+            file_id = existing["id"]
+            delete_doc_from_chroma(file_id)
+            update_document_upload(file_id, content_hash, status="indexing")
+        else:
+            file_id = insert_document_record(filename, status="indexing", content_hash=content_hash)
+        destination = os.path.join(upload_dir, *filename.split("/"))
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(path, destination)
+        state["files"][key] = {"file_id": file_id, "sha256": content_hash, "status": "indexing"}
+        todo[key] = file_id
+    _save_state(state, state_path)
+    print(f"{len(files)} files found, {len(files) - len(todo) - len(busy)} already indexed, "
+          f"{len(todo)} to index")
+    for filename in busy:
+        print(f"  skipped {filename}: being indexed by the server")
+    if not todo:
+        return state
+
+    def on_file_done(path, chunk_count):
+        update_document_status(todo[path], "indexed", chunk_count)
+        bump_corpus_version()
+        state["files"][path]["status"] = "indexed"
+        _save_state(state, state_path)
+        print(f"  indexed {os.path.relpath(path, folder)}")
+
+    writer = ChunkWriter(get_vectorstore(), embedding_function, get_encoding(), token_budget, write_batch,
+                         on_file_done)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_parse, path): path for path in todo}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                chunks = future.result()
+            except Exception as e:
+                print(f"  failed to parse {os.path.relpath(path, folder)}: {e}")
+                update_document_status(todo[path], "failed")
+                state["files"][path]["status"] = "failed"
+                _save_state(state, state_path)
+                continue
+            writer.add_file(path, todo[path], chunks)
+    writer.flush()
+
+    looked_up = sum(writer.cache_counts.values())
+    print(f"Done: {writer.embed_calls} embedding requests, "
+          f"{writer.cache_counts['hits']}/{looked_up} chunks served from the embedding cache")
+    return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-index a folder of documents into Chroma.")
+    parser.add_argument("folder", help="folder to scan recursively for .pdf/.docx/.html files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parser processes")
+    parser.add_argument("--token-budget", type=int, default=250_000,
+                        help="max tokens per embedding request")
+    parser.add_argument("--write-batch", type=int, default=2000, help="chunks per Chroma upsert")
+    parser.add_argument("--state", default=DEFAULT_STATE_FILE, help="checkpoint file for resuming")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.folder):
+        parser.error(f"not a directory: {args.folder}")
+    bulk_ingest(args.folder, args.workers, args.token_budget, args.write_batch, args.state)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,81 +1,431 @@
 from dotenv import load_dotenv
 load_dotenv()   # ← ensure OPENAI_API_KEY is in os.environ
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
-from typing import List
+from typing import Iterator, List
 from langchain_core.documents import Document
+import hashlib
 import os
+import threading
+from collections import Counter
 
-# Initialize text splitter and embedding function
+from lexical_index import BM25Index, VERBATIM_FAST_PATH
+from vector_index import MatryoshkaIndex
+from metrics import span, INGEST_STAGE_SECONDS
+from deployment import READ_ONLY
+from pipeline import Pipeline
 
-# text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=150, length_function=len)
-# embedding_function = OpenAIEmbeddings()
-import tiktoken
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
+# The tokenizer, embedding client and Chroma client are created on first use (or by
+# warm_up() at API startup) rather than at import, so processes that only need a part of
+# this module - e.g. the bulk_ingest parser workers - don't pay for the rest.
+_resources = {}
+_resources_lock = threading.RLock()
 
-# Pick the shared tokenizer encoding
-encoding = tiktoken.get_encoding("cl100k_base")
+def _lazy(name, build):
+    resource = _resources.get(name)
+    if resource is None:
+        with _resources_lock:
+            resource = _resources.get(name)
+            if resource is None:
+                resource = _resources[name] = build()
+    return resource
+
+def is_initialized(name: str) -> bool:
+    return name in _resources
 
-# Token-aware splitter
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=300,
-    chunk_overlap=50,
-    length_function=lambda txt: len(encoding.encode(txt)),
-    # split on paragraphs, sentences, then words
-    separators=["\n\n", "\n", ".", "!", "?", ",", " "]
-)
+# Pick the shared tokenizer encoding
+def get_encoding():
+    import tiktoken
+    return _lazy("encoding", lambda: tiktoken.get_encoding("cl100k_base"))
 
-# Use whichever embedding model you prefer
-embedding_function = OpenAIEmbeddings(model="text-embedding-3-large")
+# Token-aware splitter: tokenizes each page once and cuts on token offsets
+# (RecursiveCharacterTextSplitter with a tiktoken length_function re-encodes every piece)
+def get_text_splitter():
+    from token_splitter import TokenOffsetSplitter
+    return _lazy("text_splitter", lambda: TokenOffsetSplitter(
+        get_encoding(),
+        chunk_size=300,
+        chunk_overlap=50,
+        # split on paragraphs, sentences, then words
+        separators=["\n\n", "\n", ".", "!", "?", ",", " "]
+    ))
 
+# Use whichever embedding model you prefer; vectors are cached on disk by (model, chunk text)
+EMBEDDING_MODEL = "text-embedding-3-large"
 
+def get_embedding_function():
+    from langchain_openai import OpenAIEmbeddings
+    from embedding_cache import CachedEmbeddings
+    return _lazy("embedding_function", lambda: CachedEmbeddings(
+        OpenAIEmbeddings(model=EMBEDDING_MODEL), model=EMBEDDING_MODEL
+    ))
 
 # Initialize Chroma vector store
-vectorstore = Chroma(persist_directory="./chroma_db", embedding_function=embedding_function)
+CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
+
+def get_vectorstore():
+    from langchain_chroma import Chroma
+    return _lazy("vectorstore", lambda: Chroma(
+        persist_directory=CHROMA_PERSIST_DIR, embedding_function=get_embedding_function()
+    ))
+
+# In-process BM25 index over the same chunks, kept in sync with every write and delete below
+lexical_index = BM25Index()
+_lexical_loaded = False
+_lexical_lock = threading.Lock()
+
+def get_lexical_index() -> BM25Index:
+    global _lexical_loaded
+    if not _lexical_loaded:
+        with _lexical_lock:
+            if not _lexical_loaded:
+                data = get_vectorstore()._collection.get(include=["documents", "metadatas"])
+                lexical_index.add(data["ids"], data["documents"], data["metadatas"])
+                _lexical_loaded = True
+    return lexical_index
+
+# Optional in-process vector index (RAG_RETRIEVER_BACKEND=memory). It is only loaded
+# when first used; once loaded it is kept in sync with every write and delete below.
+vector_index = MatryoshkaIndex()
+_vector_loaded = False
+_vector_lock = threading.RLock()
+
+def get_vector_index() -> MatryoshkaIndex:
+    global _vector_loaded
+    if not _vector_loaded:
+        with _vector_lock:
+            if not _vector_loaded:
+                # Rebuild from Chroma if the saved matrix is missing or out of date
+                # (e.g. after bulk_ingest.py wrote to the collection directly)
+                _load_vector_index(vector_index, get_vectorstore()._collection)
+                _vector_loaded = True
+    return vector_index
+
+def _load_vector_index(index, collection):
+    if not index.load() or len(index) != collection.count():
+        # Read-only workers leave the saved files to the writer
+        index.rebuild(collection, save=not READ_ONLY)
+
+# Returns the chunk that contains the question word-for-word, if any (answered without the LLM)
+def find_verbatim_answer(question: str):
+    if not VERBATIM_FAST_PATH:
+        return None
+    return get_lexical_index().find_verbatim(question)
+
+# Chunks are embedded and written in batches so long uploads can report progress and be cancelled
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "64"))
+
+
+class IndexingCancelled(Exception):
+    pass
+
+
+# Bumped whenever chunks are added or removed, so anything derived from the
+# corpus (e.g. the semantic answer cache) can tell that it is stale. The change is also
+# published as the corpus generation in SQLite for other processes (read-only workers,
+# or a server while bulk_ingest.py runs).
+_corpus_version = 0
+_corpus_version_lock = threading.Lock()
+# The published generation this process's indexes reflect; a different one in SQLite
+# means another process changed the collection
+_loaded_generation = None
+
+def get_corpus_version() -> int:
+    return _corpus_version
+
+def _bump_local_corpus_version():
+    global _corpus_version
+    with _corpus_version_lock:
+        _corpus_version += 1
+
+# publish=False for the intermediate steps of a larger change (e.g. each batch of an
+# upload): other processes then reload once, when it is complete
+def bump_corpus_version(publish=True):
+    global _corpus_version, _loaded_generation
+    from db_utils import bump_corpus_generation
+    with _corpus_version_lock:
+        _corpus_version += 1
+        if not publish:
+            return
+        generation = bump_corpus_generation()
+        # Our own change, unless another process published one in between
+        if _loaded_generation == generation - 1:
+            _loaded_generation = generation
+
+def get_loaded_generation():
+    return _loaded_generation
+
+def set_loaded_generation(generation):
+    global _loaded_generation
+    with _corpus_version_lock:
+        _loaded_generation = generation
+
+# Called when another process has published a new corpus generation.
+# Chroma's client keeps the HNSW index it loaded in memory, so a new client is opened
+# and the lexical and vector indexes are rebuilt from it, then everything is swapped in
+# at once. Requests already running finish on the old objects; RAG chains built on them
+# must be invalidated by the caller. `generation` is the published generation being loaded.
+#
+# Dropping Chroma's cached System does not stop it, so the one being replaced is stopped
+# at the next reload, by when requests that were still using it have finished.
+_retired_systems = []
+
+def reload_corpus(generation=None):
+    global lexical_index, vector_index
+    from chromadb.api.shared_system_client import SharedSystemClient
+    from langchain_chroma import Chroma
+    replaced = list(SharedSystemClient._identifier_to_system.values())
+    SharedSystemClient.clear_system_cache()
+    store = Chroma(persist_directory=CHROMA_PERSIST_DIR, embedding_function=get_embedding_function())
+    collection = store._collection
+    new_lexical = BM25Index()
+    if _lexical_loaded:
+        data = collection.get(include=["documents", "metadatas"])
+        new_lexical.add(data["ids"], data["documents"], data["metadatas"])
+    new_vector = MatryoshkaIndex()
+    if _vector_loaded:
+        _load_vector_index(new_vector, collection)
+    with _lexical_lock, _vector_lock, _resources_lock:
+        _resources["vectorstore"] = store
+        lexical_index = new_lexical
+        vector_index = new_vector
+    _bump_local_corpus_version()
+    if generation is not None:
+        set_loaded_generation(generation)
+    for system in _retired_systems:
+        try:
+            system.stop()
+        except Exception as e:
+            print(f"Error stopping a replaced Chroma client: {e}")
+    _retired_systems[:] = replaced
+
 
 # Documnet Loading and splitting
-def load_and_split_document(file_path: str) -> List[Document]:
+def _document_loader(file_path: str):
+    from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
     if file_path.endswith('.pdf'):
-        loader = PyPDFLoader(file_path)
+        return PyPDFLoader(file_path)
     elif file_path.endswith('.docx'):
-        loader = Docx2txtLoader(file_path)
+        return Docx2txtLoader(file_path)
     elif file_path.endswith('.html'):
-        loader = UnstructuredHTMLLoader(file_path)
+        return UnstructuredHTMLLoader(file_path)
     else:
         raise ValueError(f"Unsupported file type: {file_path}")
 
-    documents = loader.load()
-    return text_splitter.split_documents(documents)
+def load_document(file_path: str) -> List[Document]:
+    return _document_loader(file_path).load()
+
+# One page at a time (PDFs are parsed page by page; .docx and .html yield a single document)
+def iter_document_pages(file_path: str) -> Iterator[Document]:
+    return _document_loader(file_path).lazy_load()
+
+# Chunks are keyed by the page they came from: "<hash of the page text>:<occurrence>",
+# the occurrence telling apart identical pages (e.g. blank ones) of one document. The key
+# does not depend on where the page is, so inserting or removing a page leaves the keys
+# of the others unchanged. Chunk ids are "<file_id>:<page key>:<n>", so a re-upload can
+# tell unchanged pages from their ids alone and only re-split and re-embed the pages
+# that changed. `seen` counts the page hashes met so far in the document.
+def page_key(page: Document, seen: Counter) -> str:
+    digest = hashlib.sha256(page.page_content.encode()).hexdigest()[:16]
+    key = f"{digest}:{seen[digest]}"
+    seen[digest] += 1
+    return key
+
+def chunk_id(file_id: int, key: str, n: int) -> str:
+    return f"{file_id}:{key}:{n}"
+
+def _page_key_of(chunk_id: str):
+    parts = chunk_id.split(":")
+    # Chunks written before page keys existed ("<file_id>-<n>") match no page
+    return f"{parts[1]}:{parts[2]}" if len(parts) == 4 else None
+
+def split_page(page: Document, key: str) -> List[Document]:
+    splits = get_text_splitter().split_documents([page])
+    for split in splits:
+        split.metadata["page_key"] = key
+    return splits
+
+def load_and_split_document(file_path: str) -> List[Document]:
+    seen = Counter()
+    return [split for page in load_document(file_path) for split in split_page(page, page_key(page, seen))]
 # document Indexing 
 
-def index_document_to_chroma(file_path: str, file_id: int) -> bool:
-    try:   
-        splits = load_and_split_document(file_path)
+# progress(stage, chunks_done, chunks_total) is called as the pipeline advances;
+# should_cancel() is polled between pages and batches and aborts when true.
+#
+# The document streams through four stages running concurrently, connected by bounded
+# queues (pipeline.py): pages are parsed one at a time, split, embedded in batches of
+# INDEX_BATCH_SIZE, and written to Chroma by the calling thread. Embedding overlaps with
+# parsing, and only a few pages and batches are held in memory whatever the file size.
+# chunks_total grows as pages are split.
+#
+# Re-indexing an existing file_id is incremental: pages whose text is unchanged keep
+# their chunks, changed pages are re-split and re-embedded, and chunks of pages that no
+# longer exist are deleted only after every new chunk has been written. If the run fails
+# or is cancelled, the chunks it wrote are removed and the previous version stays intact.
+# `source`, if given, is recorded as the chunks' source instead of file_path (an upload is
+# indexed from its staging file and only moved into place once indexed).
+def index_document_to_chroma(file_path: str, file_id: int, progress=None, should_cancel=None,
+                             source: str = None) -> bool:
+    progress = progress or (lambda stage, done=0, total=0: None)
+    should_cancel = should_cancel or (lambda: False)
+    written = []
+    embeddings = get_embedding_function()
+    existing_pages, current_pages, changed_pages = set(), set(), set()
+    moved_pages = {}                    # unchanged page key -> its loader metadata in this version
+    total = [0]
+    cache_counts = Counter()            # embedding cache hits and misses of this run
+
+    def check_cancelled():
+        if should_cancel():
+            raise IndexingCancelled(f"Indexing of file_id {file_id} was cancelled")
+
+    def read_pages():
+        pages = iter_document_pages(file_path)
+        while True:
+            check_cancelled()
+            with span("load", INGEST_STAGE_SECONDS):
+                page = next(pages, None)
+            if page is None:
+                return
+            if source:
+                page.metadata["source"] = source
+            yield page
 
-        # Add metadata to each split
-        for split in splits:
-            split.metadata['file_id'] = file_id
+    def split(pages):
+        batch, seen = [], Counter()
+        for page in pages:
+            key = page_key(page, seen)
+            current_pages.add(key)
+            if key in existing_pages:
+                # Unchanged, but it may have moved: its page number is refreshed below
+                moved_pages[key] = page.metadata
+                continue
+            changed_pages.add(key)
+            with span("split", INGEST_STAGE_SECONDS):
+                splits = split_page(page, key)
+            for n, chunk in enumerate(splits):
+                # Add metadata to each split
+                chunk.metadata['file_id'] = file_id
+                batch.append((chunk_id(file_id, key, n), chunk))
+            total[0] += len(splits)
+            while len(batch) >= INDEX_BATCH_SIZE:
+                yield batch[:INDEX_BATCH_SIZE]
+                batch = batch[INDEX_BATCH_SIZE:]
+        if batch:
+            yield batch
 
-        vectorstore.add_documents(splits)
+    def embed(batches):
+        for batch in batches:
+            check_cancelled()
+            texts = [chunk.page_content for _, chunk in batch]
+            with span("embed", INGEST_STAGE_SECONDS):
+                vectors = embeddings.embed_documents(texts, counts=cache_counts)
+            yield batch, texts, vectors
+
+    try:
+        stored = get_vectorstore()._collection.get(where={"file_id": file_id}, include=["metadatas"])
+        existing = stored["ids"]
+        existing_pages.update(_page_key_of(cid) for cid in existing)
+        progress("loading")
+        with Pipeline(read_pages(), split, embed, name=f"ingest-{file_id}") as batches:
+            for batch, texts, vectors in batches:
+                check_cancelled()
+                batch_ids = [cid for cid, _ in batch]
+                metadatas = [chunk.metadata for _, chunk in batch]
+                # Embedded here rather than in add_documents so the same vectors feed the vector
+                # index. The collection is looked up per batch, as a reload may replace it.
+                with span("write", INGEST_STAGE_SECONDS), _vector_lock:
+                    get_vectorstore()._collection.upsert(ids=batch_ids, documents=texts, metadatas=metadatas,
+                                                         embeddings=vectors)
+                    if _vector_loaded:
+                        vector_index.add(batch_ids, vectors, [file_id] * len(batch_ids))
+                written.extend(batch_ids)
+                with span("lexical_index", INGEST_STAGE_SECONDS):
+                    lexical_index.add(batch_ids, texts, metadatas)
+                bump_corpus_version(publish=False)
+                progress("embedding", len(written), total[0])
+        stale = [cid for cid in existing if _page_key_of(cid) not in current_pages]
+        # Unchanged pages whose page number (or other loader metadata) differs now
+        moved = {}
+        for cid, metadata in zip(existing, stored["metadatas"]):
+            page_metadata = moved_pages.get(_page_key_of(cid))
+            metadata = metadata or {}
+            if page_metadata and any(metadata.get(k) != v for k, v in page_metadata.items()):
+                moved[cid] = {**metadata, **page_metadata}
+        print(f"file_id {file_id}: {len(changed_pages)}/{len(current_pages)} pages indexed, "
+              f"{len(written)} chunks written, {len(stale)} stale chunks, {len(moved)} chunks moved")
+        if stale:
+            with span("delete_stale", INGEST_STAGE_SECONDS):
+                _delete_chunks(stale, publish=False)
+        if moved:
+            with span("update_metadata", INGEST_STAGE_SECONDS):
+                _update_metadata(moved)
+        if written or stale or moved:
+            # Published once the document is complete, not after every batch
+            bump_corpus_version()
+        with _vector_lock:
+            if _vector_loaded:
+                vector_index.save()
+        print(f"Embedding cache: {cache_counts['hits']}/{len(written)} chunks served from cache "
+              f"(lifetime hit rate {embeddings.stats()['hit_rate']:.1%})")
         return True
+    except IndexingCancelled:
+        if written:
+            _delete_chunks(written)
+        raise
     except Exception as e:
         print(f"Error indexing document: {e}")
+        if written:
+            _delete_chunks(written)
         return False
     
  # deleting Documents
-def delete_doc_from_chroma(file_id: int):
-    try:
-        docs = vectorstore.get(where={"file_id": file_id})
-        print(f"Found {len(docs['ids'])} document chunks for file_id {file_id}")
+# Chroma caps how many ids one request may carry
+CHROMA_DELETE_BATCH = int(os.getenv("CHROMA_DELETE_BATCH", "5000"))
+
+def _delete_chunks(ids, publish=True):
+    with _vector_lock:
+        for start in range(0, len(ids), CHROMA_DELETE_BATCH):
+            get_vectorstore()._collection.delete(ids=ids[start:start + CHROMA_DELETE_BATCH])
+        if _vector_loaded:
+            vector_index.remove(ids)
+            vector_index.save()
+    lexical_index.remove(ids)
+    bump_corpus_version(publish)
 
-        vectorstore._collection.delete(where={"file_id": file_id})
-        print(f"Deleted all documents with file_id {file_id}")
+def _update_metadata(metadatas):
+    # chunk id -> full replacement metadata; text and vectors are left as they are
+    ids = list(metadatas)
+    for start in range(0, len(ids), CHROMA_DELETE_BATCH):
+        batch = ids[start:start + CHROMA_DELETE_BATCH]
+        get_vectorstore()._collection.update(ids=batch, metadatas=[metadatas[cid] for cid in batch])
+    lexical_index.update_metadata(ids, [metadatas[cid] for cid in ids])
 
+def delete_docs_from_chroma(file_ids: List[int]) -> bool:
+    try:
+        # Ids only: no documents, metadata or embeddings are read back
+        ids = get_vectorstore()._collection.get(where={"file_id": {"$in": list(file_ids)}}, include=[])["ids"]
+        print(f"Found {len(ids)} document chunks for file_ids {list(file_ids)}")
+        if ids:
+            _delete_chunks(ids)
+        print(f"Deleted all documents with file_ids {list(file_ids)}")
         return True
     except Exception as e:
-        print(f"Error deleting document with file_id {file_id} from Chroma: {str(e)}")
+        print(f"Error deleting documents with file_ids {list(file_ids)} from Chroma: {str(e)}")
         return False
 
+def delete_doc_from_chroma(file_id: int) -> bool:
+    return delete_docs_from_chroma([file_id])
+
+# Number of chunks per file_id in the collection (reads metadata only, a page at a time)
+def document_chunk_count(file_id: int) -> int:
+    return len(get_vectorstore()._collection.get(where={"file_id": file_id}, include=[])["ids"])
+
+def chroma_chunk_counts(page_size: int = 5000) -> Counter:
+    counts = Counter()
+    offset = 0
+    while True:
+        page = get_vectorstore()._collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        counts.update(m.get("file_id") for m in page["metadatas"] if m)
+        if len(page["ids"]) < page_size:
+            return counts
+        offset += page_size
@@ -0,0 +1,126 @@
+import os
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+
+from chroma_utils import get_encoding
+from lexical_index import tokenize
+from metrics import CONTEXT_TOKENS, CONTEXT_TOKENS_SAVED
+
+# Context assembly between retrieval and generation. Retrieved chunks are
+#   1. merged: neighbouring chunks of the same page (ids "<file_id>:<page key>:<n>") become
+#      one passage, with the 50-token overlap the splitter repeats at each cut kept once;
+#   2. deduplicated: a passage whose words are mostly contained in a higher-ranked one is
+#      dropped (e.g. the same PDF uploaded under two names);
+#   3. packed: passages are kept in retrieval order while they fit the token budget.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.9"))
+
+
+def _chunk_position(doc):
+    # (file_id, page key, n) from the chunk id, or None for ids from before page keys
+    parts = (doc.id or "").split(":")
+    if len(parts) != 4 or not parts[3].isdigit():
+        return None
+    return parts[0], f"{parts[1]}:{parts[2]}", int(parts[3])
+
+
+def _overlap(left, right, probe=24):
+    # Length of the longest suffix of left that is a prefix of right
+    head = right[:probe]
+    pos = left.find(head, max(0, len(left) - len(right)))
+    while pos != -1:
+        if right.startswith(left[pos:]):
+            return len(left) - pos
+        pos = left.find(head, pos + 1)
+    return 0
+
+
+def merge_adjacent(docs: List[Document]) -> List[Document]:
+    # Runs of consecutive chunks from one page are joined in page order and placed at the
+    # rank of their best chunk; everything else passes through unchanged
+    groups, order = {}, []
+    for rank, doc in enumerate(docs):
+        position = _chunk_position(doc)
+        key = position[:2] if position else ("rank", rank)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append((position[2] if position else 0, doc))
+
+    passages = []
+    for key in order:
+        run_n, run = None, []
+        for n, doc in sorted(groups[key], key=lambda item: item[0]):
+            if run and n != run_n + 1:
+                passages.append(_join(run))
+                run = []
+            run.append(doc)
+            run_n = n
+        passages.append(_join(run))
+    return passages
+
+
+def _join(run):
+    text = run[0].page_content
+    for doc in run[1:]:
+        shared = _overlap(text, doc.page_content)
+        text += doc.page_content[shared:] if shared else "\n" + doc.page_content
+    metadata = dict(run[0].metadata)
+    if len(run) > 1:
+        metadata["merged_chunks"] = [doc.id for doc in run]
+    return Document(page_content=text, metadata=metadata, id=run[0].id)
+
+
+def drop_near_duplicates(passages: List[Document], threshold=CONTEXT_DEDUP_THRESHOLD) -> List[Document]:
+    kept, kept_words = [], []
+    for passage in passages:
+        words = set(tokenize(passage.page_content))
+        if words and any(len(words & other) / len(words) >= threshold for other in kept_words):
+            continue
+        kept.append(passage)
+        kept_words.append(words)
+    return kept
+
+
+def pack_context(docs: List[Document], budget=CONTEXT_TOKEN_BUDGET) -> List[Document]:
+    encoding = get_encoding()
+
+    def count(passages):
+        return [len(encoding.encode(p.page_content, disallowed_special=())) for p in passages]
+
+    retrieved = sum(count(docs))
+    merged = merge_adjacent(docs)
+    merged_tokens = sum(count(merged))
+    unique = drop_near_duplicates(merged)
+    sizes = count(unique)
+
+    packed, used = [], 0
+    for passage, size in zip(unique, sizes):
+        if used + size <= budget:
+            packed.append(passage)
+            used += size
+        elif not packed:
+            # The best passage alone is over budget: keep its first `budget` tokens
+            tokens = encoding.encode(passage.page_content, disallowed_special=())[:budget]
+            packed.append(Document(page_content=encoding.decode(tokens), metadata=passage.metadata, id=passage.id))
+            used = len(tokens)
+
+    CONTEXT_TOKENS.labels("retrieved").inc(retrieved)
+    CONTEXT_TOKENS.labels("packed").inc(used)
+    CONTEXT_TOKENS_SAVED.labels("overlap").inc(max(0, retrieved - merged_tokens))
+    CONTEXT_TOKENS_SAVED.labels("duplicate").inc(max(0, merged_tokens - sum(sizes)))
+    CONTEXT_TOKENS_SAVED.labels("budget").inc(max(0, sum(sizes) - used))
+    return packed
+
+
+def context_packer(budget=CONTEXT_TOKEN_BUDGET):
+    def pack(docs):
+        return pack_context(docs, budget)
+
+    async def apack(docs):
+        # A few hundred tokens to encode; not worth a thread hop
+        return pack_context(docs, budget)
+
+    return RunnableLambda(pack, afunc=apack, name="pack_context")
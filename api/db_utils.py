@@ -1,21 +1,54 @@
 import sqlite3
+import asyncio
+import threading
+import time
 from datetime import datetime
 import os
+from log_writer import WriteBehindLogger
+from metrics import timed
 
-DB_NAME = os.path.join(os.path.dirname(__file__), "rag_app.db")
+DB_NAME = os.getenv("RAG_DB_PATH", os.path.join(os.path.dirname(__file__), "rag_app.db"))
 
 
 #DB_NAME = "rag_app.db"
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+_local = threading.local()
+
+_initialized = False
+_init_lock = threading.Lock()
+
+# One long-lived connection per thread instead of a connect/close per statement.
+# Reusing the connection also reuses sqlite3's per-connection prepared-statement cache.
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_NAME, timeout=30, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        # WAL lets readers proceed while a write is in progress; NORMAL sync is safe with WAL
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
     return conn
 
+def get_db_connection():
+    if not _initialized:
+        init_db()
+    return _connect()
+
+def close_db_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# Chat, feedback and login events are append-only, so they are queued and group-committed
+# in the background instead of paying a commit on the request path.
+log_writer = WriteBehindLogger(get_db_connection).register_atexit()
+
 # ----------------- CHAT LOGS ----------------- #
 
 def create_application_logs():
-    conn = get_db_connection()
+    conn = _connect()
     conn.execute('''
         CREATE TABLE IF NOT EXISTS application_logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -26,80 +59,161 @@ def create_application_logs():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    conn.close()
 
+INSERT_APPLICATION_LOG = '''
+    INSERT INTO application_logs (session_id, user_query, gpt_response, model)
+    VALUES (?, ?, ?, ?)
+'''
+
+@timed("insert_application_logs")
 def insert_application_logs(session_id, user_query, gpt_response, model):
-    conn = get_db_connection()
-    conn.execute('''
-        INSERT INTO application_logs (session_id, user_query, gpt_response, model)
-        VALUES (?, ?, ?, ?)
-    ''', (session_id, user_query, gpt_response, model))
-    conn.commit()
-    conn.close()
+    log_writer.enqueue(INSERT_APPLICATION_LOG, (session_id, user_query, gpt_response, model), key=session_id)
 
+@timed("insert_application_logs_many")
+def insert_application_logs_many(rows):
+    # rows of (session_id, user_query, gpt_response, model), e.g. a whole /chat/batch run
+    log_writer.enqueue_many(INSERT_APPLICATION_LOG, [(row, row[0]) for row in rows])
+
+@timed("get_chat_history")
 def get_chat_history(session_id):
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT user_query, gpt_response
-        FROM application_logs
-        WHERE session_id = ?
-        ORDER BY created_at
-    ''', (session_id,))
+    # Holding the commit lock means each turn is seen exactly once: committed or still queued
+    with log_writer.commit_lock:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT user_query, gpt_response
+            FROM application_logs
+            WHERE session_id = ?
+            ORDER BY created_at, id
+        ''', (session_id,))
+        rows = [(row["user_query"], row["gpt_response"]) for row in cursor.fetchall()]
+        rows += [(params[1], params[2]) for params in log_writer.pending(INSERT_APPLICATION_LOG, session_id)]
     messages = []
-    for row in cursor.fetchall():
+    for user_query, gpt_response in rows:
         messages.extend([
-            {"role": "human", "content": row["user_query"]},
-            {"role": "ai", "content": row["gpt_response"]}
+            {"role": "human", "content": user_query},
+            {"role": "ai", "content": gpt_response}
         ])
-    conn.close()
     return messages
 
+# Inserts only enqueue, inline while the log queue has room; when it is full (backpressure)
+# the wait happens on a worker thread rather than on the event loop. Reads run on a worker
+# thread because sqlite3 blocks.
+async def ainsert_application_logs(session_id, user_query, gpt_response, model):
+    params = (session_id, user_query, gpt_response, model)
+    if not log_writer.enqueue(INSERT_APPLICATION_LOG, params, key=session_id, block=False):
+        await asyncio.to_thread(insert_application_logs, *params)
+
+async def aget_chat_history(session_id):
+    return await asyncio.to_thread(get_chat_history, session_id)
+
 # ----------------- DOCUMENTS ----------------- #
 
 def create_document_store():
-    conn = get_db_connection()
+    conn = _connect()
     conn.execute('''
         CREATE TABLE IF NOT EXISTS document_store (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             filename TEXT,
-            upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT NOT NULL DEFAULT 'indexed',
+            content_hash TEXT,
+            chunk_count INTEGER
         )
     ''')
-    conn.close()
 
-def insert_document_record(filename):
+# status: pending → indexing → indexed | failed | cancelled
+@timed("insert_document_record")
+def insert_document_record(filename, status="indexed", content_hash=None):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('INSERT INTO document_store (filename) VALUES (?)', (filename,))
+    cursor.execute('INSERT INTO document_store (filename, status, content_hash) VALUES (?, ?, ?)',
+                   (filename, status, content_hash))
     file_id = cursor.lastrowid
     conn.commit()
-    conn.close()
     return file_id
 
+@timed("update_document_status")
+def update_document_status(file_id, status, chunk_count=None):
+    # False when the record no longer exists. chunk_count is recorded when a document
+    # finishes indexing (0 for one without any text, e.g. a scanned PDF)
+    conn = get_db_connection()
+    if chunk_count is None:
+        cursor = conn.execute('UPDATE document_store SET status = ? WHERE id = ?', (status, file_id))
+    else:
+        cursor = conn.execute('UPDATE document_store SET status = ?, chunk_count = ? WHERE id = ?',
+                              (status, chunk_count, file_id))
+    conn.commit()
+    return cursor.rowcount > 0
+
+# A (re-)upload that finished indexing: the record now describes the new version
+@timed("finish_document_upload")
+def finish_document_upload(file_id, content_hash, chunk_count):
+    # False when the record no longer exists
+    conn = get_db_connection()
+    cursor = conn.execute(
+        "UPDATE document_store SET status = 'indexed', content_hash = ?, chunk_count = ?, "
+        "upload_timestamp = CURRENT_TIMESTAMP WHERE id = ?",
+        (content_hash, chunk_count, file_id)
+    )
+    conn.commit()
+    return cursor.rowcount > 0
+
+# Latest record for a filename, used to turn a re-upload into an incremental update
+@timed("find_document_by_filename")
+def find_document_by_filename(filename):
+    conn = get_db_connection()
+    row = conn.execute(
+        'SELECT id, status, content_hash FROM document_store WHERE filename = ? ORDER BY id DESC LIMIT 1',
+        (filename,)
+    ).fetchone()
+    return dict(row) if row else None
+
+@timed("update_document_upload")
+def update_document_upload(file_id, content_hash, status="pending"):
+    conn = get_db_connection()
+    conn.execute(
+        'UPDATE document_store SET content_hash = ?, status = ?, upload_timestamp = CURRENT_TIMESTAMP WHERE id = ?',
+        (content_hash, status, file_id)
+    )
+    conn.commit()
+
+def fail_interrupted_documents():
+    # Jobs do not survive a restart, so anything left pending/indexing was interrupted
+    conn = get_db_connection()
+    conn.execute("UPDATE document_store SET status = 'failed' WHERE status IN ('pending', 'indexing')")
+    conn.commit()
+
+@timed("delete_document_record")
 def delete_document_record(file_id):
     conn = get_db_connection()
     conn.execute('DELETE FROM document_store WHERE id = ?', (file_id,))
     conn.commit()
-    conn.close()
     return True
 
+@timed("delete_document_records")
+def delete_document_records(file_ids):
+    conn = get_db_connection()
+    with conn:
+        conn.executemany('DELETE FROM document_store WHERE id = ?', [(file_id,) for file_id in file_ids])
+    return True
+
+@timed("get_all_documents")
 def get_all_documents():
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute('''
-        SELECT id, filename, upload_timestamp
+        SELECT id, filename, upload_timestamp, status, chunk_count
         FROM document_store
         ORDER BY upload_timestamp DESC
     ''')
     documents = cursor.fetchall()
-    conn.close()
     return [dict(doc) for doc in documents]
 
 # ----------------- FEEDBACK ----------------- #
 
 def create_feedback_logs():
-    conn = get_db_connection()
+    conn = _connect()
     conn.execute('''
         CREATE TABLE IF NOT EXISTS feedback_logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -110,21 +224,18 @@ def create_feedback_logs():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    conn.close()
 
+@timed("insert_feedback_log")
 def insert_feedback_log(session_id, user_query, model_response, feedback):
-    conn = get_db_connection()
-    conn.execute('''
+    log_writer.enqueue('''
         INSERT INTO feedback_logs (session_id, user_query, model_response, feedback)
         VALUES (?, ?, ?, ?)
     ''', (session_id, user_query, model_response, feedback))
-    conn.commit()
-    conn.close()
 
 # ----------------- USER LOGIN ----------------- #
 
 def create_user_login_table():
-    conn = get_db_connection()
+    conn = _connect()
     conn.execute('''
         CREATE TABLE IF NOT EXISTS user_logins (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -134,17 +245,15 @@ def create_user_login_table():
             login_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    conn.close()
 
+@timed("insert_user_login")
 def insert_user_login(name, email, phone):
-    conn = get_db_connection()
-    conn.execute('''
+    log_writer.enqueue('''
         INSERT INTO user_logins (name, email, phone)
         VALUES (?, ?, ?)
     ''', (name, email, phone))
-    conn.commit()
-    conn.close()
 
+@timed("get_all_logged_users")
 def get_all_logged_users():
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -154,7 +263,6 @@ def get_all_logged_users():
         ORDER BY login_time DESC
     ''')
     rows = cursor.fetchall()
-    conn.close()
     return [
         {
             "id": row["id"],
@@ -168,67 +276,192 @@ def get_all_logged_users():
 
 # ----------------- Create allowed user table ----------------- #
 def create_allowed_users_table():
-    conn = get_db_connection()
+    conn = _connect()
     conn.execute('''
         CREATE TABLE IF NOT EXISTS allowed_users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT,
             email TEXT,
-            phone TEXT
+            phone TEXT,
+            name_key TEXT,
+            email_key TEXT,
+            phone_key TEXT
         )
     ''')
-    conn.close()
 
+# Logins match case- and whitespace-insensitively on name and email, and ignoring
+# surrounding whitespace on phone; the normalized values are stored as key columns
+# under a unique index.
+def allowed_user_key(name, email, phone):
+    return ((name or "").strip().lower(), (email or "").strip().lower(), (phone or "").strip())
+
+# The whole allow-list is kept in memory as a set of keys. Changes made through this
+# module invalidate it immediately; changes from other processes show up within the TTL.
+ALLOWED_USERS_CACHE_TTL = float(os.getenv("ALLOWED_USERS_CACHE_TTL", "60"))
+_allowed_keys = None
+_allowed_loaded_at = 0.0
+_allowed_lock = threading.Lock()
+
+def invalidate_allowed_users_cache():
+    global _allowed_keys
+    with _allowed_lock:
+        _allowed_keys = None
+
+def _get_allowed_keys():
+    global _allowed_keys, _allowed_loaded_at
+    with _allowed_lock:
+        if _allowed_keys is None or time.monotonic() - _allowed_loaded_at > ALLOWED_USERS_CACHE_TTL:
+            rows = get_db_connection().execute('SELECT name_key, email_key, phone_key FROM allowed_users')
+            _allowed_keys = {tuple(row) for row in rows}
+            _allowed_loaded_at = time.monotonic()
+        return _allowed_keys
+
+@timed("insert_allowed_users")
 def insert_allowed_users(users):
     conn = get_db_connection()
     cursor = conn.cursor()
+    # Users already on the list (by normalized key) are skipped
     cursor.executemany(
         '''
-        INSERT INTO allowed_users (name, email, phone)
-        VALUES (?, ?, ?)
+        INSERT OR IGNORE INTO allowed_users (name, email, phone, name_key, email_key, phone_key)
+        VALUES (?, ?, ?, ?, ?, ?)
         ''',
-        [(u["name"], u["email"], u["phone"]) for u in users]
+        [(u["name"], u["email"], u["phone"], *allowed_user_key(u["name"], u["email"], u["phone"]))
+         for u in users]
     )
     conn.commit()
-    conn.close()
+    invalidate_allowed_users_cache()
+    return cursor.rowcount
 
+@timed("delete_allowed_user")
 def delete_allowed_user(email):
     conn = get_db_connection()
-    conn.execute('DELETE FROM allowed_users WHERE email = ?', (email,))
+    conn.execute('DELETE FROM allowed_users WHERE email_key = ?', (allowed_user_key("", email, "")[1],))
     conn.commit()
-    conn.close()
+    invalidate_allowed_users_cache()
 
+@timed("is_user_allowed")
 def is_user_allowed(name, email, phone):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        SELECT COUNT(*) FROM allowed_users
-        WHERE LOWER(TRIM(name)) = LOWER(TRIM(?))
-          AND LOWER(TRIM(email)) = LOWER(TRIM(?))
-          AND TRIM(phone) = TRIM(?)
-        ''',
-        (name, email, phone)
-    )
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count > 0
+    return allowed_user_key(name, email, phone) in _get_allowed_keys()
 
+@timed("list_allowed_users")
 def list_allowed_users():
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute('SELECT name, email, phone FROM allowed_users')
     rows = cursor.fetchall()
-    conn.close()
     return [dict(row) for row in rows]
 
 
 
 
+# ----------------- CORPUS GENERATION ----------------- #
+# Incremented after every change to the Chroma collection. Read-only workers poll it to
+# know when their in-memory view of the collection is out of date (see deployment.py).
+
+def create_corpus_state():
+    conn = _connect()
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS corpus_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                generation INTEGER NOT NULL
+            )
+        ''')
+        conn.execute("INSERT OR IGNORE INTO corpus_state (id, generation) VALUES (1, 0)")
+
+def get_corpus_generation():
+    conn = get_db_connection()
+    return conn.execute("SELECT generation FROM corpus_state WHERE id = 1").fetchone()[0]
+
+def bump_corpus_generation():
+    # Returns the new generation
+    conn = get_db_connection()
+    with conn:
+        conn.execute("UPDATE corpus_state SET generation = generation + 1 WHERE id = 1")
+        return conn.execute("SELECT generation FROM corpus_state WHERE id = 1").fetchone()[0]
+
+# ----------------- MIGRATIONS ----------------- #
+# Applied in order to existing databases; PRAGMA user_version records how many have run.
+
+def _add_document_status(conn):
+    # Databases created before background ingestion lack the status column
+    columns = [row["name"] for row in conn.execute("PRAGMA table_info(document_store)")]
+    if "status" not in columns:
+        conn.execute("ALTER TABLE document_store ADD COLUMN status TEXT NOT NULL DEFAULT 'indexed'")
+
+def _add_lookup_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_application_logs_session ON application_logs (session_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_document_store_uploaded ON document_store (upload_timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_logs_session ON feedback_logs (session_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_logins_time ON user_logins (login_time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_allowed_users_email ON allowed_users (email)")
+
+def _add_document_content_hash(conn):
+    # sha256 of the uploaded file, so an unchanged re-upload can be skipped
+    columns = [row["name"] for row in conn.execute("PRAGMA table_info(document_store)")]
+    if "content_hash" not in columns:
+        conn.execute("ALTER TABLE document_store ADD COLUMN content_hash TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_document_store_filename ON document_store (filename)")
+
+def _add_document_chunk_count(conn):
+    # Rows indexed before this keep NULL: their chunk count is unknown
+    columns = [row["name"] for row in conn.execute("PRAGMA table_info(document_store)")]
+    if "chunk_count" not in columns:
+        conn.execute("ALTER TABLE document_store ADD COLUMN chunk_count INTEGER")
+
+def _add_allowed_user_keys(conn):
+    columns = [row["name"] for row in conn.execute("PRAGMA table_info(allowed_users)")]
+    for column in ("name_key", "email_key", "phone_key"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE allowed_users ADD COLUMN {column} TEXT")
+    rows = conn.execute("SELECT id, name, email, phone FROM allowed_users").fetchall()
+    conn.executemany(
+        "UPDATE allowed_users SET name_key = ?, email_key = ?, phone_key = ? WHERE id = ?",
+        [(*allowed_user_key(row["name"], row["email"], row["phone"]), row["id"]) for row in rows]
+    )
+    # Keep the oldest row of each duplicate before the unique index goes on
+    conn.execute('''
+        DELETE FROM allowed_users WHERE id NOT IN (
+            SELECT MIN(id) FROM allowed_users GROUP BY email_key, name_key, phone_key
+        )
+    ''')
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_allowed_users_key "
+                 "ON allowed_users (email_key, name_key, phone_key)")
+
+MIGRATIONS = [
+    _add_document_status,
+    _add_lookup_indexes,
+    _add_document_content_hash,
+    _add_allowed_user_keys,
+    _add_document_chunk_count,
+]
+
+def migrate_db():
+    conn = _connect()
+    with conn:
+        # Takes the write lock before reading the version, so uvicorn workers starting
+        # together apply each migration once
+        conn.execute("BEGIN IMMEDIATE")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+
 # ----------------- INIT ALL TABLES ----------------- #
+# Creates missing tables and applies migrations once per process: explicitly at API
+# startup and in the CLI scripts, otherwise on the first query.
 
-create_application_logs()
-create_document_store()
-create_feedback_logs()
-create_user_login_table()
-create_allowed_users_table()
+def init_db():
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        create_application_logs()
+        create_document_store()
+        create_feedback_logs()
+        create_user_login_table()
+        create_allowed_users_table()
+        create_corpus_state()
+        migrate_db()
+        _initialized = True
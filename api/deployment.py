@@ -0,0 +1,19 @@
+import os
+
+# How this process takes part in a deployment (RAG_ROLE):
+#   all     one process serves everything (the default, same as a plain `uvicorn main:app`)
+#   writer  the single process that ingests and deletes documents; it publishes a corpus
+#           generation in SQLite after every change to the Chroma collection
+#   reader  a read-only query worker; any number of these can run, e.g.
+#           `RAG_ROLE=reader RAG_WRITER_URL=http://127.0.0.1:8001 uvicorn main:app --workers 8`.
+#           Ingest and delete requests are forwarded to RAG_WRITER_URL.
+# Every role reopens the collection when another process (the writer, or bulk_ingest.py)
+# publishes a new generation.
+RAG_ROLE = os.getenv("RAG_ROLE", "all")
+if RAG_ROLE not in ("all", "writer", "reader"):
+    raise ValueError(f"RAG_ROLE must be all, writer or reader, not {RAG_ROLE!r}")
+
+READ_ONLY = RAG_ROLE == "reader"
+RAG_WRITER_URL = os.getenv("RAG_WRITER_URL", "").rstrip("/")
+# How often the corpus generation is checked, in seconds
+CORPUS_POLL_SECONDS = float(os.getenv("CORPUS_POLL_SECONDS", "5"))
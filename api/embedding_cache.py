@@ -0,0 +1,120 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(__file__), "embedding_cache.db")
+)
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float32")   # or "float16" to halve disk use
+
+# SQLite's default limit on bound parameters per statement
+_LOOKUP_BATCH = 900
+
+
+class CachedEmbeddings(Embeddings):
+    # Content-addressed cache in front of an embedding model. Vectors are keyed by
+    # sha256(model, text) and stored as raw float arrays, so re-uploading a document
+    # (or re-chunking it with mostly unchanged text) costs no embedding calls. Only
+    # document chunks are cached: questions go straight to the wrapped model.
+
+    def __init__(self, embeddings, model, path=EMBEDDING_CACHE_PATH, dtype=EMBEDDING_CACHE_DTYPE):
+        self.embeddings = embeddings
+        self.model = model
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dtype TEXT NOT NULL,
+                vector BLOB NOT NULL
+            )
+        ''')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        conn = self._conn()
+        for i in range(0, len(keys), _LOOKUP_BATCH):
+            batch = keys[i:i + _LOOKUP_BATCH]
+            rows = conn.execute(
+                f"SELECT key, dtype, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            for key, dtype, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=dtype).astype(np.float32).tolist()
+        return found
+
+    def _store(self, items):
+        conn = self._conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, dtype, vector) VALUES (?, ?, ?)",
+            [(key, self.dtype.str, np.asarray(vec, dtype=self.dtype).tobytes()) for key, vec in items],
+        )
+        conn.commit()
+
+    def embed_documents(self, texts, counts=None, chunk_size=None):
+        # counts, if given (e.g. a Counter), accumulates this call's "hits" and "misses".
+        # chunk_size, if given, is passed on to the wrapped model as the most texts it may
+        # send per request (OpenAIEmbeddings otherwise splits into requests of its own
+        # chunk_size, 1000)
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(list(set(keys)))
+
+        # Embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        if missing:
+            kwargs = {"chunk_size": chunk_size} if chunk_size else {}
+            vectors = self.embeddings.embed_documents(list(missing.values()), **kwargs)
+            fresh = list(zip(missing.keys(), vectors))
+            self._store(fresh)
+            cached.update(fresh)
+
+        with self._stats_lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        if counts is not None:
+            counts["hits"] += len(texts) - len(missing)
+            counts["misses"] += len(missing)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text):
+        return await self.embeddings.aembed_query(text)
+
+    def embed_queries(self, texts):
+        # Many questions in one request (/chat/batch), uncached like embed_query
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self):
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
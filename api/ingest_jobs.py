@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+from chroma_utils import index_document_to_chroma, delete_doc_from_chroma, document_chunk_count, IndexingCancelled
+from db_utils import update_document_status, finish_document_upload
+
+# Uploads are indexed by a small worker pool so /upload-doc can return immediately
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Finished jobs kept around for /jobs/{id} lookups
+JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "500"))
+# How long a delete waits for a running job of the same document to roll back
+INGEST_CANCEL_TIMEOUT = float(os.getenv("INGEST_CANCEL_TIMEOUT", "30"))
+
+
+@dataclass
+class IngestJob:
+    file_id: int
+    filename: str
+    path: str                        # staged upload, indexed from here
+    destination: str                 # where the file goes once it is indexed
+    content_hash: Optional[str] = None
+    previous_status: Optional[str] = None   # the record's status before a re-upload
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "pending"          # pending → indexing → indexed | failed | cancelled
+    stage: str = "queued"            # queued → loading → embedding → done
+    chunks_done: int = 0
+    chunks_total: int = 0
+    error: Optional[str] = None
+    finished_at: Optional[float] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    done_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "file_id": self.file_id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "chunks_done": self.chunks_done,
+            "chunks_total": self.chunks_total,
+            "error": self.error,
+        }
+
+
+_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+# The record, and the file in uploaded_docs/, only describe the new version once it is
+# indexed. Until then they keep the previous one, whose chunks are served meanwhile and
+# stay in place if the job fails or is cancelled: a re-upload of an indexed document then
+# goes back to "indexed" with its old content_hash, and the staged file is discarded.
+def _finish(job, status, error=None):
+    if status == "indexed":
+        # Recorded so reconcile.py can tell a document without text from lost chunks
+        if finish_document_upload(job.file_id, job.content_hash, document_chunk_count(job.file_id)):
+            os.replace(job.path, job.destination)
+        else:
+            # The record was deleted while the job ran: its chunks must not outlive it
+            delete_doc_from_chroma(job.file_id)
+            status, error = "cancelled", "Document was deleted while it was being indexed"
+    else:
+        update_document_status(job.file_id, "indexed" if job.previous_status == "indexed" else status)
+    if status != "indexed":
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
+    job.status = status
+    job.stage = "done"
+    job.error = error
+    job.finished_at = time.time()
+    job.done_event.set()
+
+
+def _claim(job):
+    # pending → indexing, unless the job was cancelled before a worker got to it (the
+    # canceller then finishes it)
+    with _jobs_lock:
+        if job.cancel_event.is_set():
+            return False
+        job.status = "indexing"
+        return True
+
+
+def _run(job):
+    if not _claim(job):
+        return
+
+    def progress(stage, done=0, total=0):
+        job.stage = stage
+        job.chunks_done = done
+        job.chunks_total = total
+
+    update_document_status(job.file_id, "indexing")
+    try:
+        ok = index_document_to_chroma(job.path, job.file_id, progress=progress,
+                                      should_cancel=job.cancel_event.is_set, source=job.destination)
+    except IndexingCancelled:
+        _finish(job, "cancelled")
+    except Exception as e:
+        _finish(job, "failed", str(e))
+    else:
+        if ok:
+            _finish(job, "indexed")
+        else:
+            _finish(job, "failed", "Failed to index document.")
+
+
+def _prune():
+    finished = sorted((j for j in _jobs.values() if j.finished), key=lambda j: j.finished_at)
+    for job in finished[:max(0, len(finished) - JOB_HISTORY)]:
+        del _jobs[job.job_id]
+
+
+def submit_ingest_job(path, file_id, filename, destination, content_hash=None, previous_status=None):
+    job = IngestJob(file_id=file_id, filename=filename, path=path, destination=destination,
+                    content_hash=content_hash, previous_status=previous_status)
+    with _jobs_lock:
+        _prune()
+        _jobs[job.job_id] = job
+    _executor.submit(_run, job)
+    return job
+
+
+def ingest_backlog():
+    # Submitted jobs no worker has picked up yet
+    return sum(1 for job in list(_jobs.values()) if job.status == "pending")
+
+
+def get_job(job_id):
+    return _jobs.get(job_id)
+
+
+def _cancel(job):
+    with _jobs_lock:
+        job.cancel_event.set()
+        unclaimed = job.status == "pending"
+        if unclaimed:
+            job.status = "cancelled"
+    if unclaimed:
+        _finish(job, "cancelled")
+
+
+def cancel_job(job_id):
+    job = _jobs.get(job_id)
+    if job is None or job.finished:
+        return False
+    _cancel(job)
+    return True
+
+
+def cancel_jobs_for(file_ids, timeout=INGEST_CANCEL_TIMEOUT):
+    # Cancels the unfinished jobs of these documents and waits until they have rolled
+    # back their chunks; False if one is still running after `timeout` seconds
+    file_ids = set(file_ids)
+    jobs = [job for job in list(_jobs.values()) if job.file_id in file_ids and not job.finished]
+    for job in jobs:
+        _cancel(job)
+    deadline = time.monotonic() + timeout
+    return all(job.done_event.wait(max(0.0, deadline - time.monotonic())) for job in jobs)
+
+
+def shutdown_ingest_jobs():
+    for job in list(_jobs.values()):
+        job.cancel_event.set()
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -1,14 +1,31 @@
 from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+from langchain_core.runnables import Runnable, RunnableBranch, RunnableLambda, RunnablePassthrough
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from typing import List
+from typing import List, NamedTuple
 from langchain_core.documents import Document
+from operator import itemgetter
 import os
-from chroma_utils import vectorstore
+import threading
+import httpx
+from chroma_utils import get_vectorstore, get_embedding_function, get_lexical_index, get_vector_index
+from lexical_index import HybridRetriever, fuse_results
+from vector_index import MatryoshkaRetriever
+from metrics import metrics_handler
+from context_packing import context_packer, pack_context, CONTEXT_TOKEN_BUDGET
 
-retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+# Retriever settings are part of the chain registry key, so changing them
+# through set_retriever_config() transparently rebuilds the affected chains.
+retriever_config = {
+    "k": int(os.getenv("RAG_RETRIEVER_K", "3")),
+    # "chroma" (HNSW in Chroma) or "memory" (in-process prefix search + full-dimension rerank)
+    "backend": os.getenv("RAG_RETRIEVER_BACKEND", "chroma"),
+    # fuse BM25 results with the vector search
+    "hybrid": os.getenv("RAG_HYBRID_RETRIEVAL", "1") == "1",
+    # merge, deduplicate and token-budget the retrieved chunks (context_packing.py); 0 disables packing
+    "token_budget": CONTEXT_TOKEN_BUDGET,
+}
 
 output_parser = StrOutputParser()
 ## setting up the prompt
@@ -123,13 +140,129 @@ qa_prompt = ChatPromptTemplate.from_messages([
 ])'''
 
 
-# creting a langchain
+# ——— Chain registry ————————————————————————————————————————————————————————
+# Building the LLM + history-aware retriever + stuff chain is pure overhead per request,
+# so pipelines are built once per (model, temperature, retriever config) and reused.
+# All of them share one pooled HTTP client, which keeps TLS connections to the provider alive.
 
-def get_rag_chain(model="GPT-4 Turbo", temprature=0.2):
-    llm = ChatOpenAI(model=model)
-    history_aware_retriever = create_history_aware_retriever(llm, retriever, contextualize_q_prompt)
+_http_limits = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+_http_timeout = httpx.Timeout(60.0, connect=10.0)
+http_client = httpx.Client(limits=_http_limits, timeout=_http_timeout)
+http_async_client = httpx.AsyncClient(limits=_http_limits, timeout=_http_timeout)
+
+_chain_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _registry_key(model, temperature):
+    return (model, float(temperature), tuple(sorted(retriever_config.items())))
+
+
+def build_retriever():
+    if retriever_config["backend"] == "memory":
+        retriever = MatryoshkaRetriever(index=get_vector_index(), embeddings=get_embedding_function(),
+                                        collection=get_vectorstore()._collection, k=retriever_config["k"])
+    else:
+        retriever = get_vectorstore().as_retriever(search_kwargs={"k": retriever_config["k"]})
+    if retriever_config["hybrid"]:
+        retriever = HybridRetriever(vector_retriever=retriever, lexical_index=get_lexical_index(),
+                                    k=retriever_config["k"])
+    return retriever
+
+
+def retrieve_by_vectors(questions, vectors):
+    # Same documents build_retriever() + context packing would return for each question,
+    # given its embedding; the vector searches run as one batch (/chat/batch)
+    k = retriever_config["k"]
+    if retriever_config["backend"] == "memory":
+        retriever = MatryoshkaRetriever(index=get_vector_index(), embeddings=get_embedding_function(),
+                                        collection=get_vectorstore()._collection, k=k)
+        results = retriever.search_by_vectors(vectors)
+    else:
+        found = get_vectorstore()._collection.query(query_embeddings=vectors, n_results=k,
+                                                    include=["documents", "metadatas"])
+        results = [[Document(page_content=text, metadata=meta or {}, id=cid)
+                    for cid, text, meta in zip(ids, texts, metas)]
+                   for ids, texts, metas in zip(found["ids"], found["documents"], found["metadatas"])]
+    if retriever_config["hybrid"]:
+        lexical_index = get_lexical_index()
+        results = [fuse_results(docs, lexical_index, question, k) for question, docs in zip(questions, results)]
+    if retriever_config["token_budget"] > 0:
+        results = [pack_context(docs, retriever_config["token_budget"]) for docs in results]
+    return results
+
+
+class RagPipeline(NamedTuple):
+    # {"input", "chat_history"} -> standalone question (no LLM call when there is no history)
+    contextualize: Runnable
+    # {"input", "chat_history", "standalone_question"} -> adds "context" and "answer"; with
+    # "question_vector" (the standalone question's embedding) retrieval searches by it
+    # instead of embedding the question again
+    answer: Runnable
+    # contextualize followed by answer; same output keys as create_retrieval_chain
+    chain: Runnable
+    # {"input", "chat_history", "context"} -> adds "answer"; for callers that retrieve themselves
+    generate: Runnable
+
+
+def build_rag_pipeline(model, temperature):
+    # stream_usage reports token counts for streamed answers too
+    llm = ChatOpenAI(model=model, temperature=temperature, stream_usage=True,
+                     http_client=http_client, http_async_client=http_async_client)
+    retriever = build_retriever()
+    if retriever_config["token_budget"] > 0:
+        retriever = retriever | context_packer(retriever_config["token_budget"])
+    # Same behaviour as create_history_aware_retriever, with the standalone question exposed
+    contextualize = RunnableBranch(
+        (lambda x: not x.get("chat_history"), itemgetter("input")),
+        contextualize_q_prompt | llm | output_parser,
+    ).with_config(run_name="contextualize_question", callbacks=[metrics_handler])
     question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
-    rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)    
-    return rag_chain
+    retrieve = RunnableBranch(
+        (lambda x: x.get("question_vector") is not None,
+         RunnableLambda(lambda x: retrieve_by_vectors([x["standalone_question"]], [x["question_vector"]])[0])),
+        itemgetter("standalone_question") | retriever,
+    )
+    answer = (
+        RunnablePassthrough.assign(context=retrieve)
+        .assign(answer=question_answer_chain)
+    ).with_config(run_name="retrieve_and_answer", callbacks=[metrics_handler])
+    chain = RunnablePassthrough.assign(standalone_question=contextualize) | answer
+    generate = RunnablePassthrough.assign(answer=question_answer_chain).with_config(
+        run_name="generate_answer", callbacks=[metrics_handler])
+    return RagPipeline(contextualize, answer, chain, generate)
+
+
+def get_rag_pipeline(model="gpt-4o-mini", temperature=0.2):
+    key = _registry_key(model, temperature)
+    pipeline = _chain_registry.get(key)
+    if pipeline is None:
+        with _registry_lock:
+            pipeline = _chain_registry.get(key)
+            if pipeline is None:
+                pipeline = _chain_registry[key] = build_rag_pipeline(model, temperature)
+    return pipeline
+
+
+def get_rag_chain(model="gpt-4o-mini", temperature=0.2):
+    return get_rag_pipeline(model, temperature).chain
+
+
+def warm_rag_chains(models, temperature=0.2):
+    for model in models:
+        get_rag_chain(model, temperature)
+
+
+def invalidate_rag_chains():
+    with _registry_lock:
+        _chain_registry.clear()
+
+
+def set_retriever_config(**config):
+    retriever_config.update(config)
+    invalidate_rag_chains()
 
 
+async def close_http_clients():
+    http_client.close()
+    await http_async_client.aclose()
@@ -0,0 +1,196 @@
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+# Word characters plus the Devanagari block, whose vowel signs are not \w
+_TOKEN_RE = re.compile(r"[\w\u0900-\u097F]+")
+
+# Opt-in: answers a question that appears word-for-word in a chunk (an FAQ entry, a
+# heading) with the text that follows it, skipping the LLM
+VERBATIM_FAST_PATH = os.getenv("VERBATIM_FAST_PATH", "0") == "1"
+# Shorter questions ("what is IMS") are too likely to appear verbatim by accident
+VERBATIM_MIN_TOKENS = int(os.getenv("VERBATIM_MIN_TOKENS", "8"))
+# An answer span must have at least this many words, and ends after at most
+# VERBATIM_MAX_SENTENCES sentences, a blank line or the next question
+VERBATIM_MIN_ANSWER_TOKENS = int(os.getenv("VERBATIM_MIN_ANSWER_TOKENS", "5"))
+VERBATIM_MAX_SENTENCES = int(os.getenv("VERBATIM_MAX_SENTENCES", "3"))
+
+_SENTENCE_END_RE = re.compile(r"[.!?।](?=\s|$)")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    # In-process inverted index over the same chunks stored in Chroma (keyed by chunk id),
+    # scored with Okapi BM25.
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}             # term -> {chunk_id: term frequency}
+        self._chunks = {}               # chunk_id -> (text, metadata, tokens)
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def add(self, ids, texts, metadatas):
+        with self._lock:
+            for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                if chunk_id in self._chunks:
+                    self._remove(chunk_id)
+                tokens = tokenize(text)
+                self._chunks[chunk_id] = (text, metadata or {}, tokens)
+                self._total_length += len(tokens)
+                for term, tf in Counter(tokens).items():
+                    self._postings.setdefault(term, {})[chunk_id] = tf
+
+    def _remove(self, chunk_id):
+        text, metadata, tokens = self._chunks.pop(chunk_id)
+        self._total_length -= len(tokens)
+        for term in set(tokens):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def remove(self, ids):
+        with self._lock:
+            for chunk_id in ids:
+                if chunk_id in self._chunks:
+                    self._remove(chunk_id)
+
+    def update_metadata(self, ids, metadatas):
+        with self._lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                if chunk_id in self._chunks:
+                    text, _, tokens = self._chunks[chunk_id]
+                    self._chunks[chunk_id] = (text, metadata or {}, tokens)
+
+    def remove_file(self, file_id):
+        with self._lock:
+            self.remove([cid for cid, (_, meta, _) in self._chunks.items() if meta.get("file_id") == file_id])
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._chunks.clear()
+            self._total_length = 0
+
+    def search(self, query, k=3):
+        terms = set(tokenize(query))
+        with self._lock:
+            n = len(self._chunks)
+            if not n or not terms:
+                return []
+            avg_length = self._total_length / n
+            scores = Counter()
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    length = len(self._chunks[chunk_id][2])
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+            return scores.most_common(k)
+
+    def document(self, chunk_id):
+        text, metadata, _ = self._chunks[chunk_id]
+        return Document(page_content=text, metadata=dict(metadata), id=chunk_id)
+
+    def find_verbatim(self, question, candidates=5):
+        # The answer to a question that a chunk contains word-for-word (ignoring case and
+        # punctuation), as a Document holding only the answer span; None unless a
+        # confident span is found (see answer_span)
+        needle = tokenize(question)
+        if len(needle) < VERBATIM_MIN_TOKENS:
+            return None
+        with self._lock:
+            for chunk_id, _ in self.search(question, candidates):
+                text, metadata, tokens = self._chunks[chunk_id]
+                for start in range(len(tokens) - len(needle) + 1):
+                    if tokens[start:start + len(needle)] == needle:
+                        answer = answer_span(text, start + len(needle))
+                        if answer is not None:
+                            return Document(page_content=answer, metadata=dict(metadata), id=chunk_id)
+        return None
+
+
+def answer_span(text, after_token):
+    # The text following the question that ends at token `after_token`, if it reads as
+    # its answer: the question must end its line or be closed by "?" / ":" (a heading or
+    # FAQ entry, not a phrase in running text), and the answer runs to a blank line, the
+    # next question or its VERBATIM_MAX_SENTENCES-th sentence. A span cut off by the end
+    # of the chunk, or shorter than VERBATIM_MIN_ANSWER_TOKENS words, is not confident.
+    end = list(_TOKEN_RE.finditer(text))[after_token - 1].end()
+    closing = re.match(r"[ \t]*([?:]+|\n)", text[end:])
+    if closing is None:
+        return None
+    section, *rest = re.split(r"\n\s*\n", text[end + closing.end():].strip(), maxsplit=1)
+    complete = bool(rest)
+    lines = []
+    for line in section.splitlines():
+        if lines and line.rstrip().endswith("?"):
+            complete = True
+            break
+        lines.append(line)
+    span = "\n".join(lines).strip()
+    sentence_ends = [m.end() for m in _SENTENCE_END_RE.finditer(span)]
+    if len(sentence_ends) >= VERBATIM_MAX_SENTENCES:
+        span, complete = span[:sentence_ends[VERBATIM_MAX_SENTENCES - 1]], True
+    elif sentence_ends and sentence_ends[-1] == len(span):
+        complete = True
+    if not complete or len(tokenize(span)) < VERBATIM_MIN_ANSWER_TOKENS:
+        return None
+    return span
+
+
+def fuse_results(vector_docs, lexical_index, query, k=3, rrf_k=60):
+    # Reciprocal rank fusion of vector hits with the BM25 hits for the same query
+    scores, docs = Counter(), {}
+    for rank, doc in enumerate(vector_docs):
+        key = doc.id or doc.page_content
+        scores[key] += 1 / (rrf_k + rank + 1)
+        docs.setdefault(key, doc)
+    for rank, (chunk_id, _) in enumerate(lexical_index.search(query, k)):
+        scores[chunk_id] += 1 / (rrf_k + rank + 1)
+        if chunk_id not in docs:
+            docs[chunk_id] = lexical_index.document(chunk_id)
+    return [docs[key] for key, _ in scores.most_common(k)]
+
+
+class HybridRetriever(BaseRetriever):
+    # Fuses vector and BM25 results with reciprocal rank fusion, so exact terms and
+    # Hindi phrases that embeddings rank poorly still reach the prompt.
+    vector_retriever: BaseRetriever
+    lexical_index: BM25Index
+    k: int = 3
+    rrf_k: int = 60
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _fuse(self, vector_docs, query):
+        return fuse_results(vector_docs, self.lexical_index, query, self.k, self.rrf_k)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector_docs = self.vector_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return self._fuse(vector_docs, query)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        vector_docs = await self.vector_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return self._fuse(vector_docs, query)
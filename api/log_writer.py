@@ -0,0 +1,153 @@
+import atexit
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from metrics import LOG_EVENTS_DROPPED
+
+
+class WriteBehindLogger:
+    # Collects INSERTs for append-only event tables and group-commits them from a
+    # background thread, so request handlers never wait for an fsync. A batch is
+    # written when batch_size events are queued or flush_interval seconds have passed.
+    #
+    # Queued events stay visible through pending() until their batch is committed;
+    # readers that hold commit_lock see every event exactly once, either in the table
+    # or in the queue (read-your-writes for chat history).
+    #
+    # A batch whose commit fails with sqlite3.OperationalError (e.g. "database is locked")
+    # is retried write_retries times with exponential backoff before it is dropped;
+    # dropped events are counted in stats() and rag_log_events_dropped_total.
+
+    def __init__(self, connect, batch_size=256, flush_interval=0.05, max_pending=10_000,
+                 write_retries=3, retry_backoff=0.1):
+        self._connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.write_retries = write_retries
+        self.retry_backoff = retry_backoff
+        self._pending = deque()                 # (sql, params, key)
+        self._cond = threading.Condition()
+        self.commit_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self.batches_written = 0
+        self.events_written = 0
+        self.events_dropped = 0
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, sql, params, key=None, block=True):
+        # Returns False, without queueing, if the queue is full and block is False
+        with self._cond:
+            self._ensure_started()
+            # Backpressure if the disk cannot keep up
+            while len(self._pending) >= self.max_pending:
+                if not block:
+                    return False
+                self._cond.wait()
+            self._pending.append((sql, params, key))
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+            return True
+
+    def enqueue_many(self, sql, rows):
+        # rows are (params, key) pairs, queued under a single lock acquisition
+        with self._cond:
+            self._ensure_started()
+            for params, key in rows:
+                while len(self._pending) >= self.max_pending:
+                    self._cond.notify_all()
+                    self._cond.wait()
+                self._pending.append((sql, params, key))
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    def pending(self, sql, key):
+        with self._cond:
+            return [params for s, params, k in self._pending if s == sql and k == key]
+
+    def queue_depth(self):
+        return len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.batch_size and not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._pending[i] for i in range(min(self.batch_size, len(self._pending)))]
+                if not batch and self._stopping:
+                    return
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        grouped = {}
+        for sql, params, _ in batch:
+            grouped.setdefault(sql, []).append(params)
+        conn = self._connect()
+        for attempt in range(self.write_retries + 1):
+            # Released between attempts so readers are not held up by the backoff
+            with self.commit_lock:
+                try:
+                    with conn:
+                        for sql, rows in grouped.items():
+                            conn.executemany(sql, rows)
+                    error, retry = None, False
+                except sqlite3.OperationalError as e:
+                    error, retry = e, attempt < self.write_retries
+                except Exception as e:
+                    error, retry = e, False
+                if not retry:
+                    with self._cond:
+                        for _ in batch:
+                            self._pending.popleft()
+                        self._cond.notify_all()
+                    break
+            time.sleep(self.retry_backoff * 2 ** attempt)
+        if error is not None:
+            # Dropped rather than retried forever
+            print(f"Error writing {len(batch)} logged events, dropped after {attempt + 1} attempts: {error}")
+            self.events_dropped += len(batch)
+            LOG_EVENTS_DROPPED.inc(len(batch))
+            return
+        self.batches_written += 1
+        self.events_written += len(batch)
+
+    def flush(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._pending and time.monotonic() < deadline:
+                self._cond.wait(0.05)
+        return not self._pending
+
+    def stop(self, timeout=10):
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth(),
+            "batches_written": self.batches_written,
+            "events_written": self.events_written,
+            "events_dropped": self.events_dropped,
+        }
+
+    def register_atexit(self):
+        atexit.register(self.stop)
+        return self
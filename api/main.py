@@ -1,40 +1,472 @@
 import os
-import shutil
+import glob
+import hashlib
 import uuid
+import json
 import logging
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+import time
+import asyncio
+import httpx
+from contextlib import asynccontextmanager, AsyncExitStack
+from operator import itemgetter
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from pydantic_model import (
-    QueryInput, QueryResponse, DocumentInfo, DeleteFileRequest,
-    UserLogin, FeedbackModel, AllowedUser, AllowedUserList
+    ModelName, QueryInput, QueryResponse, BatchQueryInput, DocumentInfo, IngestJobInfo, DeleteFileRequest,
+    DeleteFilesRequest, UserLogin, FeedbackModel, AllowedUser, AllowedUserList
 )
 from db_utils import (
-    insert_application_logs, get_chat_history, get_all_documents,
-    insert_document_record, delete_document_record,
-    insert_feedback_log, insert_user_login, get_all_logged_users,
-    insert_allowed_users, delete_allowed_user, list_allowed_users
+    init_db, ainsert_application_logs, insert_application_logs_many, aget_chat_history, get_all_documents,
+    insert_document_record, delete_document_record, delete_document_records,
+    find_document_by_filename, update_document_status,
+    fail_interrupted_documents, insert_feedback_log, insert_user_login, get_all_logged_users,
+    insert_allowed_users, delete_allowed_user, list_allowed_users, is_user_allowed, log_writer,
+    get_corpus_generation
 )
-from chroma_utils import index_document_to_chroma, delete_doc_from_chroma
-from langchain_utils import get_rag_chain
+from chroma_utils import (
+    delete_doc_from_chroma, delete_docs_from_chroma, find_verbatim_answer,
+    get_encoding, get_vectorstore, get_lexical_index, get_embedding_function, reload_corpus,
+    get_loaded_generation, set_loaded_generation
+)
+from semantic_cache import lookup_answer, store_answer, cache_key, semantic_cache, SEMANTIC_CACHE_ENABLED
+from ingest_jobs import (
+    submit_ingest_job, get_job, cancel_job, cancel_jobs_for, shutdown_ingest_jobs, ingest_backlog
+)
+from reconcile import reconcile
+from single_flight import single_flight, coalesce_key
+from admission import Overloaded, chat_admission, batch_admission, admit_ingest
+from metrics import (
+    span, start_request_timings, server_timing, render_metrics, REQUEST_SECONDS, LOG_QUEUE_DEPTH,
+    ADMISSION_QUEUE_DEPTH, SERVER_TIMING_HEADER
+)
+from langchain_utils import (
+    get_rag_pipeline, warm_rag_chains, invalidate_rag_chains, close_http_clients,
+    retrieve_by_vectors
+)
+from deployment import READ_ONLY, RAG_ROLE, RAG_WRITER_URL, CORPUS_POLL_SECONDS
 
 # ——— Logging ———————————————————————————————————————————————————————————
 logging.basicConfig(filename='app.log', level=logging.INFO)
 
+# ——— Startup & Readiness ———————————————————————————————————————————————————
+# The database is initialized before the app accepts requests; the tokenizer, Chroma,
+# the BM25 index and the RAG chains are warmed in the background. /ready answers 503
+# until that has finished, so a load balancer only routes to warmed workers.
+WARMUP_STEPS = [
+    ("tokenizer", get_encoding),
+    ("vectorstore", get_vectorstore),
+    ("lexical_index", get_lexical_index),
+    ("rag_chains", lambda: warm_rag_chains([m.value for m in ModelName])),
+]
+readiness = {"ready": False, "role": RAG_ROLE,
+             "components": {name: "pending" for name, _ in WARMUP_STEPS}, "error": None}
+
+
+def warm_up():
+    for name, step in WARMUP_STEPS:
+        try:
+            start = time.perf_counter()
+            step()
+        except Exception as e:
+            logging.exception(f"Warm-up step {name} failed")
+            readiness["components"][name] = "failed"
+            readiness["error"] = f"{name}: {e}"
+            return
+        readiness["components"][name] = "ready"
+        logging.info(f"Warm-up step {name} took {time.perf_counter() - start:.2f}s")
+    readiness["ready"] = True
+
+
+# ——— Deployment Roles ——————————————————————————————————————————————————————
+# See deployment.py. A reader never writes to Chroma: it forwards the routes below to the
+# writer and reopens the collection when the writer publishes a new corpus generation.
+WRITER_PATHS = {"/upload-doc", "/delete-doc", "/delete-docs", "/reconcile"}
+WRITER_PATH_PREFIXES = ("/jobs/",)      # ingest jobs live in the writer process
+
+writer_client = (httpx.AsyncClient(base_url=RAG_WRITER_URL, timeout=httpx.Timeout(300.0, connect=5.0))
+                 if READ_ONLY and RAG_WRITER_URL else None)
+
+
+def is_writer_path(path):
+    return path in WRITER_PATHS or path.startswith(WRITER_PATH_PREFIXES)
+
+
+async def forward_to_writer(request: Request):
+    if writer_client is None:
+        return JSONResponse(content={"detail": "This worker is read-only and RAG_WRITER_URL is not set"},
+                            status_code=503)
+    # The body (e.g. an upload) is streamed through; Content-Length is kept as sent
+    headers = {k: v for k, v in request.headers.items() if k.lower() != "host"}
+    try:
+        upstream = await writer_client.request(request.method, request.url.path, params=request.query_params,
+                                               headers=headers, content=request.stream())
+    except httpx.HTTPError as e:
+        logging.error(f"Forwarding {request.url.path} to the writer failed: {e}")
+        return JSONResponse(content={"detail": f"Writer unavailable: {e}"}, status_code=502)
+    retry_after = upstream.headers.get("retry-after")
+    return Response(content=upstream.content, status_code=upstream.status_code,
+                    media_type=upstream.headers.get("content-type"),
+                    headers={"Retry-After": retry_after} if retry_after else None)
+
+
+# Every role watches the published generation: besides the writer, bulk_ingest.py can
+# change the collection from another process. Changes made by this process itself are
+# already in its indexes and do not trigger a reload.
+async def watch_corpus_generation():
+    while True:
+        await asyncio.sleep(CORPUS_POLL_SECONDS)
+        try:
+            generation = await asyncio.to_thread(get_corpus_generation)
+            seen = get_loaded_generation()
+            if generation == seen:
+                continue
+            start = time.perf_counter()
+            await asyncio.to_thread(reload_corpus, generation)
+            invalidate_rag_chains()
+            logging.info(f"Reloaded corpus generation {generation} (was {seen}) "
+                         f"in {time.perf_counter() - start:.2f}s")
+        except Exception:
+            logging.exception("Corpus reload failed; retrying on the next poll")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    init_db()
+    # Read before warm-up opens the collection, so no change in between is missed
+    set_loaded_generation(get_corpus_generation())
+    watcher = asyncio.create_task(watch_corpus_generation())
+    if not READ_ONLY:
+        # Only the writer knows which ingest jobs were really interrupted
+        fail_interrupted_documents()
+        for staged in glob.glob(os.path.join("uploaded_docs", ".*.part.*")):
+            os.remove(staged)
+    logging.info(f"Starting as {RAG_ROLE}")
+    warmup = asyncio.create_task(asyncio.to_thread(warm_up))
+    yield
+    readiness["ready"] = False
+    watcher.cancel()
+    shutdown_ingest_jobs()
+    log_writer.stop()
+    await close_http_clients()
+    if writer_client is not None:
+        await writer_client.aclose()
+    if not warmup.done():
+        warmup.cancel()
+
+
 # ——— App Init ——————————————————————————————————————————————————————————  
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+LOG_QUEUE_DEPTH.set_function(log_writer.queue_depth)
+ADMISSION_QUEUE_DEPTH.labels("ingest").set_function(ingest_backlog)
+
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    timings = start_request_timings()
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    REQUEST_SECONDS.labels(request.method, path, response.status_code).observe(time.perf_counter() - start)
+    # Streaming responses send their headers before most stages have run
+    if SERVER_TIMING_HEADER and timings:
+        response.headers["Server-Timing"] = server_timing(timings)
+    return response
+
+
+@app.middleware("http")
+async def route_writes_to_writer(request: Request, call_next):
+    if READ_ONLY and is_writer_path(request.url.path):
+        return await forward_to_writer(request)
+    return await call_next(request)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, exc: Overloaded):
+    # Admission control turned the request away (admission.py)
+    logging.warning(f"{request.url.path}: {exc}")
+    return JSONResponse(content={"detail": str(exc)}, status_code=429,
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    return JSONResponse(content=readiness, status_code=200 if readiness["ready"] else 503)
 
 
 # ——— 1) Chat Endpoint —————————————————————————————————————————————————————
+async def find_shortcut_answer(standalone_question, model):
+    # Answers that need no generation, cheapest first: a chunk containing the question
+    # word-for-word, then the semantic cache. Returns (answer, source, cache key for store_answer);
+    # on a cache miss, pass the key's vector to the pipeline as "question_vector" so
+    # retrieval does not embed the question again.
+    snippet = find_verbatim_answer(standalone_question)
+    if snippet is not None:
+        return snippet.page_content.strip(), "verbatim", None
+    answer, key = await lookup_answer(standalone_question, model)
+    return answer, ("cache" if answer is not None else None), key
+
+
+async def start_stream(events):
+    # Runs an NDJSON event generator up to its first event before responding, so errors
+    # raised until then (e.g. Overloaded from admission) still get a proper status code
+    first = await events.__anext__()
+
+    async def stream():
+        try:
+            yield first
+            async for event in events:
+                yield event
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+async def answer_question(pipeline, model, inputs):
+    # Returns (answer, source); source is "cache", "verbatim" or None when generated
+    with span("contextualize"):
+        inputs["standalone_question"] = await pipeline.contextualize.ainvoke(inputs)
+    with span("shortcut"):
+        answer, source, store_key = await find_shortcut_answer(inputs["standalone_question"], model)
+    if source is None:
+        if store_key is not None:
+            inputs["question_vector"] = store_key.vector
+        with span("answer"):
+            answer = (await pipeline.answer.ainvoke(inputs))["answer"]
+        store_answer(store_key, model, inputs["standalone_question"], answer)
+    return answer, source
+
+
+# Identical questions asked at the same time (same model, history and corpus) share one
+# answer: the first request does the work and the rest wait for it (single_flight.py).
+# Every request still logs its own turn. Only requests that do the work take a slot of
+# the model's admission budget (admission.py); when it is full they get a 429.
 @app.post("/chat", response_model=QueryResponse)
-def chat(query_input: QueryInput):
+async def chat(query_input: QueryInput):
     session_id = query_input.session_id or str(uuid.uuid4())
+    model      = query_input.model.value
     logging.info(f"Session {session_id} Q: {query_input.question}")
-    history   = get_chat_history(session_id)
-    chain     = get_rag_chain(query_input.model.value)
-    answer    = chain.invoke({"input": query_input.question, "chat_history": history})["answer"]
-    insert_application_logs(session_id, query_input.question, answer, query_input.model.value)
-    return QueryResponse(answer=answer, session_id=session_id, model=query_input.model)
+    with span("history"):
+        history = await aget_chat_history(session_id)
+    pipeline   = get_rag_pipeline(model)
+    inputs     = {"input": query_input.question, "chat_history": history}
+    key        = coalesce_key(query_input.question, model, history)
+    flight     = single_flight.join(key)
+    result     = None
+    if flight is not None:
+        with span("coalesced"):
+            result = await single_flight.wait(flight, "chat")
+    if result is None:
+        leader = single_flight.lead(key) if flight is None else None
+        try:
+            async with chat_admission(model).admit():
+                result = await answer_question(pipeline, model, inputs)
+        finally:
+            if leader is not None:
+                single_flight.land(key, leader, result)
+    answer, source = result
+    with span("log"):
+        await ainsert_application_logs(session_id, query_input.question, answer, model)
+    return QueryResponse(answer=answer, session_id=session_id, model=query_input.model,
+                         cached=source == "cache", verbatim=source == "verbatim")
+
+
+# Same as /chat, but streams NDJSON events while the answer is generated:
+# {"type": "start", session_id, model} → {"type": "token", content}* → {"type": "end", answer, cached, verbatim}
+# (or {"type": "error", detail} if generation fails midway). Answers that skip generation
+# (cache hits, verbatim snippets) arrive as a single token.
+@app.post("/chat/stream")
+async def chat_stream(query_input: QueryInput):
+    session_id = query_input.session_id or str(uuid.uuid4())
+    model      = query_input.model.value
+    logging.info(f"Session {session_id} Q (stream): {query_input.question}")
+    with span("history"):
+        history = await aget_chat_history(session_id)
+    pipeline   = get_rag_pipeline(model)
+    inputs     = {"input": query_input.question, "chat_history": history}
+    key        = coalesce_key(query_input.question, model, history)
+
+    async def event_stream():
+        # Coalesced like /chat; a follower receives the shared answer as a single token.
+        # A leader takes its admission slot before the "start" event (see start_stream),
+        # so a full budget is answered with a 429 rather than a failed stream.
+        async with AsyncExitStack() as admitted:
+            flight = single_flight.join(key)
+            leader = single_flight.lead(key) if flight is None else None
+            result = None
+            if leader is not None:
+                try:
+                    await admitted.enter_async_context(chat_admission(model).admit())
+                except BaseException:
+                    single_flight.land(key, leader)
+                    raise
+            try:
+                yield json.dumps({"type": "start", "session_id": session_id, "model": model}) + "\n"
+                if flight is not None:
+                    with span("coalesced"):
+                        result = await single_flight.wait(flight, "chat_stream")
+                    if result is not None:
+                        answer, source = result
+                        yield json.dumps({"type": "token", "content": answer}) + "\n"
+                    else:
+                        await admitted.enter_async_context(chat_admission(model).admit())
+                if result is None:
+                    with span("contextualize"):
+                        inputs["standalone_question"] = await pipeline.contextualize.ainvoke(inputs)
+                    with span("shortcut"):
+                        answer, source, store_key = await find_shortcut_answer(inputs["standalone_question"], model)
+                    if source is not None:
+                        yield json.dumps({"type": "token", "content": answer}) + "\n"
+                    else:
+                        if store_key is not None:
+                            inputs["question_vector"] = store_key.vector
+                        parts = []
+                        with span("answer"):
+                            async for chunk in pipeline.answer.astream(inputs):
+                                token = chunk.get("answer")
+                                if token:
+                                    parts.append(token)
+                                    yield json.dumps({"type": "token", "content": token}) + "\n"
+                        answer = "".join(parts)
+                        store_answer(store_key, model, inputs["standalone_question"], answer)
+                    result = (answer, source)
+            except Exception as e:
+                logging.exception(f"Session {session_id} streaming failed")
+                yield json.dumps({"type": "error", "detail": str(e)}) + "\n"
+                return
+            finally:
+                if leader is not None:
+                    single_flight.land(key, leader, result)
+        with span("log"):
+            await ainsert_application_logs(session_id, query_input.question, answer, model)
+        yield json.dumps({"type": "end", "answer": answer, "cached": source == "cache",
+                          "verbatim": source == "verbatim"}) + "\n"
+
+    return await start_stream(event_stream())
+
+
+# Many questions in one request, for evaluation runs and FAQ pre-generation. Standalone
+# questions are embedded in one call and retrieved as one batch; generations then run
+# CHAT_BATCH_CONCURRENCY at a time. Batches have their own admission budget, apart from
+# interactive chat. Streams NDJSON as answers complete (not in order): {"type": "start", questions}
+# → {"type": "result", index, session_id, answer, cached, verbatim} | {"type": "error", index, detail}
+# ... then {"type": "end", answered, failed}. Every question is answered independently:
+# stored session history is read once, before any answer of the batch is logged.
+CHAT_BATCH_MAX = int(os.getenv("CHAT_BATCH_MAX", "1000"))
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+
+
+@app.post("/chat/batch")
+async def chat_batch(batch: BatchQueryInput):
+    if len(batch.questions) > CHAT_BATCH_MAX:
+        raise HTTPException(413, f"At most {CHAT_BATCH_MAX} questions per batch")
+    model    = batch.model.value
+    pipeline = get_rag_pipeline(model)
+    limit    = asyncio.Semaphore(CHAT_BATCH_CONCURRENCY)
+    items    = [{"index": i, "session_id": q.session_id or str(uuid.uuid4()), "input": q.question,
+                 "history": [turn.dict() for turn in q.history] if q.history is not None else None}
+                for i, q in enumerate(batch.questions)]
+    logging.info(f"Batch of {len(items)} questions ({model})")
+
+    async def prepare(item):
+        # History and standalone question; LLM calls share the batch's concurrency limit
+        if item["history"] is None:
+            item["history"] = await aget_chat_history(item["session_id"])
+        inputs = {"input": item["input"], "chat_history": item["history"]}
+        if item["history"]:
+            async with limit:
+                item["standalone_question"] = await pipeline.contextualize.ainvoke(inputs)
+        else:
+            item["standalone_question"] = item["input"]
+
+    async def answer(item):
+        if item.get("answer") is not None:
+            return item
+        inputs = {"input": item["input"], "chat_history": item["history"], "context": item["context"]}
+        try:
+            async with limit:
+                item["answer"] = (await pipeline.generate.ainvoke(inputs))["answer"]
+        except Exception as e:
+            item["error"] = str(e)
+            return item
+        store_answer(item.get("cache_key"), model, item["standalone_question"], item["answer"])
+        return item
+
+    def shortcuts_and_retrieval(pending):
+        # Verbatim snippets first, then one embedding call for the rest, the semantic
+        # cache, and one batched retrieval for whatever is left
+        for item in pending:
+            snippet = find_verbatim_answer(item["standalone_question"])
+            if snippet is not None:
+                item["answer"], item["source"] = snippet.page_content.strip(), "verbatim"
+        pending = [item for item in pending if item.get("answer") is None]
+        if not pending:
+            return
+        questions = [item["standalone_question"] for item in pending]
+        vectors = get_embedding_function().embed_queries(questions)
+        for item, vector in zip(pending, vectors):
+            item["vector"] = vector
+            item["cache_key"] = cache_key(vector)      # taken before retrieval
+            cached = semantic_cache.lookup(vector, model) if SEMANTIC_CACHE_ENABLED else None
+            if cached is not None:
+                item["answer"], item["source"] = cached, "cache"
+        pending = [item for item in pending if item.get("answer") is None]
+        contexts = retrieve_by_vectors([item["standalone_question"] for item in pending],
+                                       [item["vector"] for item in pending])
+        for item, context in zip(pending, contexts):
+            item["context"] = context
+
+    def result_event(item):
+        return json.dumps({"type": "result", "index": item["index"], "session_id": item["session_id"],
+                           "answer": item["answer"], "cached": item.get("source") == "cache",
+                           "verbatim": item.get("source") == "verbatim"}) + "\n"
+
+    async def event_stream():
+        async with batch_admission.admit():
+            yield json.dumps({"type": "start", "questions": len(items)}) + "\n"
+            answered, failed, tasks = [], 0, []
+            try:
+                with span("contextualize"):
+                    prepared = await asyncio.gather(*(prepare(item) for item in items), return_exceptions=True)
+                ready = []
+                for item, error in zip(items, prepared):
+                    if isinstance(error, Exception):
+                        failed += 1
+                        yield json.dumps({"type": "error", "index": item["index"], "detail": str(error)}) + "\n"
+                    else:
+                        ready.append(item)
+                with span("retrieve"):
+                    await asyncio.to_thread(shortcuts_and_retrieval, ready)
+                with span("answer"):
+                    tasks = [asyncio.create_task(answer(item)) for item in ready]
+                    for task in asyncio.as_completed(tasks):
+                        item = await task
+                        if "error" in item:
+                            failed += 1
+                            yield json.dumps({"type": "error", "index": item["index"], "detail": item["error"]}) + "\n"
+                        else:
+                            answered.append(item)
+                            yield result_event(item)
+            except Exception as e:
+                logging.exception("Batch chat failed")
+                yield json.dumps({"type": "error", "index": None, "detail": str(e)}) + "\n"
+            finally:
+                for task in tasks:
+                    task.cancel()
+                # Logged in one go, in question order
+                with span("log"):
+                    await asyncio.to_thread(insert_application_logs_many,
+                                            [(item["session_id"], item["input"], item["answer"], model)
+                                             for item in sorted(answered, key=itemgetter("index"))])
+            yield json.dumps({"type": "end", "answered": len(answered), "failed": failed}) + "\n"
+
+    return await start_stream(event_stream())
 
 
 # ——— 2) Upload & Index Document —————————————————————————————————————————————
@@ -45,27 +477,56 @@ def upload_and_index_document(file: UploadFile = File(...)):
     ext = os.path.splitext(file.filename)[1].lower()
     if ext not in allowed:
         raise HTTPException(400, f"Unsupported file type: {ext}")
+    # Turned away (429) before reading the body when too many documents are waiting
+    admit_ingest(ingest_backlog())
 
-    # 2b) Save to temp
-    temp_path = f"temp_{uuid.uuid4().hex}{ext}"
+    # 2b) Stream into uploaded_docs/ under a staging name, hashing the content as it is
+    #     written; the job indexes it from there and renames it into place (same
+    #     directory, no copy) once it is indexed
+    os.makedirs("uploaded_docs", exist_ok=True)
+    temp_path = os.path.join("uploaded_docs", f".{uuid.uuid4().hex}.part{ext}")
+    digest = hashlib.sha256()
     with open(temp_path, "wb") as buf:
-        shutil.copyfileobj(file.file, buf)
+        for block in iter(lambda: file.file.read(1 << 20), b""):
+            digest.update(block)
+            buf.write(block)
+    content_hash = digest.hexdigest()
 
-    # 2c) Record in SQLite
-    file_id = insert_document_record(file.filename)
+    # 2c) Record in SQLite (pending until the background job finishes). A re-upload of
+    #     a known filename keeps its file_id so only the changed pages are re-indexed;
+    #     its content_hash is only replaced once the new version is indexed.
+    existing = find_document_by_filename(file.filename)
+    if existing and existing["status"] in ("pending", "indexing"):
+        os.remove(temp_path)
+        raise HTTPException(409, f"{file.filename} is already being indexed")
+    if existing and existing["status"] == "indexed" and existing["content_hash"] == content_hash:
+        os.remove(temp_path)
+        return {"message": "Unchanged, already indexed", "file_id": existing["id"], "job_id": None}
+    if existing:
+        file_id = existing["id"]
+        update_document_status(file_id, "pending")
+    else:
+        file_id = insert_document_record(file.filename, status="pending")
 
-    # 2d) Move to permanent storage
-    os.makedirs("uploaded_docs", exist_ok=True)
+    # 2d) Index into Chroma in the background; poll /jobs/{job_id} for progress
     perm_path = os.path.join("uploaded_docs", file.filename)
-    shutil.move(temp_path, perm_path)
+    job = submit_ingest_job(temp_path, file_id, file.filename, perm_path, content_hash,
+                            previous_status=existing["status"] if existing else None)
+    return {"message": "Uploaded, indexing in background", "file_id": file_id, "job_id": job.job_id}
+
 
-    # 2e) Index into Chroma (persists internally)
-    success = index_document_to_chroma(perm_path, file_id)
-    if not success:
-        delete_document_record(file_id)
-        raise HTTPException(500, "Failed to index document.")
+@app.get("/jobs/{job_id}", response_model=IngestJobInfo)
+def get_job_status(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(404, f"Unknown job: {job_id}")
+    return job.to_dict()
 
-    return {"message": "Uploaded & indexed", "file_id": file_id}
+@app.post("/jobs/{job_id}/cancel")
+def cancel_ingest_job(job_id: str):
+    if get_job(job_id) is None:
+        raise HTTPException(404, f"Unknown job: {job_id}")
+    return {"cancelled": cancel_job(job_id)}
 
 
 # ——— 3) List & Delete Documents —————————————————————————————————————————————
@@ -73,12 +534,29 @@ def upload_and_index_document(file: UploadFile = File(...)):
 def list_documents():
     return get_all_documents()
 
+# A document still being indexed has its job cancelled and rolled back first, so no
+# chunks are written after its record is gone
 @app.post("/delete-doc")
 def delete_document(request: DeleteFileRequest):
+    if not cancel_jobs_for([request.file_id]):
+        raise HTTPException(409, f"file_id {request.file_id} is still being indexed, try again")
     ok1 = delete_doc_from_chroma(request.file_id)
-    ok2 = delete_document_record(request.file_id)
+    # Keep the record while Chroma still holds its chunks, so the delete can be retried
+    ok2 = delete_document_record(request.file_id) if ok1 else False
     return {"deleted_in_chroma": ok1, "deleted_in_db": ok2}
 
+@app.post("/delete-docs")
+def delete_documents(request: DeleteFilesRequest):
+    if not cancel_jobs_for(request.file_ids):
+        raise HTTPException(409, "Some of these documents are still being indexed, try again")
+    ok1 = delete_docs_from_chroma(request.file_ids)
+    ok2 = delete_document_records(request.file_ids) if ok1 else False
+    return {"file_ids": request.file_ids, "deleted_in_chroma": ok1, "deleted_in_db": ok2}
+
+@app.post("/reconcile")
+def reconcile_documents(dry_run: bool = False):
+    return reconcile(repair=not dry_run)
+
 
 # ——— 4) Feedback & User Logging —————————————————————————————————————————————
 @app.post("/log-feedback")
@@ -100,18 +578,31 @@ def log_user(user: UserLogin):
 def list_users():
     return JSONResponse(content={"users": get_all_logged_users()})
 
+@app.get("/metrics")
+def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/log-queue")
+def log_queue_status():
+    return log_writer.stats()
+
 
 # ——— 5) Allowed-Users Management ————————————————————————————————————————————
 @app.post("/add-allowed-users")
 def add_allowed_users(user_list: AllowedUserList):
-    insert_allowed_users([u.dict() for u in user_list.users])
-    return {"message": "Allowed users added"}
+    added = insert_allowed_users([u.dict() for u in user_list.users])
+    return {"message": "Allowed users added", "added": added}
 
 @app.post("/delete-allowed-user")
 def remove_allowed_user(user: AllowedUser):
     delete_allowed_user(user.email)
     return {"message": f"Deleted allowed user {user.email}"}
 
+@app.post("/check-user")
+def check_user(user: UserLogin):
+    return {"allowed": is_user_allowed(user.name, user.email, user.phone)}
+
 @app.get("/list-allowed-users")
 def get_allowed_users():
     return {"users": list_allowed_users()}
@@ -0,0 +1,134 @@
+import contextvars
+import functools
+import inspect
+import os
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Adds a Server-Timing header with the per-stage durations of each request
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "0") == "1"
+
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_SECONDS = Histogram("rag_request_seconds", "HTTP request latency", ["method", "path", "status"],
+                            buckets=_LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent in each step of a chat request", ["stage"],
+                          buckets=_LATENCY_BUCKETS)
+DB_SECONDS = Histogram("rag_db_seconds", "Time spent in db_utils calls", ["operation"], buckets=_LATENCY_BUCKETS)
+LLM_SECONDS = Histogram("rag_llm_seconds", "Chat model call latency", ["model"], buckets=_LATENCY_BUCKETS)
+LLM_TOKENS = Counter("rag_llm_tokens_total", "Tokens sent to and generated by chat models", ["model", "kind"])
+INGEST_STAGE_SECONDS = Histogram("rag_ingest_stage_seconds", "Time spent in each document indexing stage",
+                                 ["stage"], buckets=_LATENCY_BUCKETS)
+CONTEXT_TOKENS = Counter("rag_context_tokens_total", "Context tokens before and after packing", ["stage"])
+CONTEXT_TOKENS_SAVED = Counter("rag_context_tokens_saved_total", "Prompt tokens removed by context packing",
+                               ["reason"])
+COALESCED_REQUESTS = Counter("rag_coalesced_requests_total",
+                             "Chat requests answered by waiting on an identical in-flight request", ["endpoint"])
+ADMISSION_IN_FLIGHT = Gauge("rag_admission_in_flight", "Requests holding an admission slot", ["budget"])
+ADMISSION_QUEUE_DEPTH = Gauge("rag_admission_queue_depth", "Requests waiting for an admission slot", ["budget"])
+ADMISSION_REJECTED = Counter("rag_admission_rejected_total", "Requests turned away with 429", ["budget", "reason"])
+ADMISSION_WAIT_SECONDS = Histogram("rag_admission_wait_seconds", "Time spent waiting for an admission slot",
+                                   ["budget"], buckets=_LATENCY_BUCKETS)
+LOG_QUEUE_DEPTH = Gauge("rag_log_queue_depth", "Logged events waiting to be written to SQLite")
+LOG_EVENTS_DROPPED = Counter("rag_log_events_dropped_total", "Logged events dropped after failed SQLite commits")
+
+# Stage name -> seconds for the request being handled, when one is being timed
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _record(histogram, name, seconds):
+    histogram.labels(name).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name, histogram=STAGE_SECONDS):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(histogram, name, time.perf_counter() - start)
+
+
+def timed(name, histogram=DB_SECONDS):
+    # Decorator version of span() for plain and async functions
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, histogram):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, histogram):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def start_request_timings():
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing(timings):
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+def render_metrics():
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    # Times retriever and chat model runs inside the RAG chains and counts model tokens
+    run_inline = True
+
+    def __init__(self):
+        self._started = {}          # run_id -> (start time, model)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        # Retrievers nested in another one (e.g. the vector side of HybridRetriever) are
+        # part of the outer retrieval, not a stage of their own
+        if parent_run_id not in self._started:
+            self._started[run_id] = (time.perf_counter(), None)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started:
+            _record(STAGE_SECONDS, "retrieve", time.perf_counter() - started[0])
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        model = (metadata or {}).get("ls_model_name") or kwargs.get("invocation_params", {}).get("model", "unknown")
+        self._started[run_id] = (time.perf_counter(), model)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if not started:
+            return
+        start, model = started
+        seconds = time.perf_counter() - start
+        LLM_SECONDS.labels(model).observe(seconds)
+        _record(STAGE_SECONDS, "llm", seconds)
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    LLM_TOKENS.labels(model, "prompt").inc(usage.get("input_tokens", 0))
+                    LLM_TOKENS.labels(model, "completion").inc(usage.get("output_tokens", 0))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+
+metrics_handler = MetricsCallbackHandler()
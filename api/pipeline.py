@@ -0,0 +1,93 @@
+import os
+import queue
+import threading
+
+# Items buffered between two stages; bounds memory to a few pages/batches per stage
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class Pipeline:
+    # Runs a source iterable and a chain of stages in their own threads, connected by
+    # bounded queues, and yields the last stage's output to the consuming thread. Each
+    # stage is a function from an iterable of inputs to an iterable of outputs, so it can
+    # batch or filter freely. A full queue blocks the stage feeding it (backpressure).
+    #
+    # The first exception raised by any stage is re-raised in the consumer. Leaving the
+    # `with` block, normally or not, stops every stage and waits for its thread to exit.
+    #
+    #   with Pipeline(read_pages(), split, embed) as batches:
+    #       for batch in batches:
+    #           write(batch)
+
+    def __init__(self, source, *stages, maxsize=INGEST_QUEUE_SIZE, name="pipeline"):
+        self._queues = [queue.Queue(maxsize) for _ in range(len(stages) + 1)]
+        self._stop = threading.Event()
+        self._error = None
+        self._threads = [threading.Thread(target=self._run, args=(source, None, self._queues[0]),
+                                          name=f"{name}-source", daemon=True)]
+        for i, stage in enumerate(stages):
+            self._threads.append(threading.Thread(
+                target=self._run, args=(None, stage, self._queues[i + 1], self._queues[i]),
+                name=f"{name}-{getattr(stage, '__name__', i)}", daemon=True,
+            ))
+
+    def _put(self, q, item):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _drain(self, q):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise _Stopped()
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def _run(self, source, stage, out, inp=None):
+        try:
+            items = source if stage is None else stage(self._drain(inp))
+            for item in items:
+                self._put(out, item)
+            self._put(out, _DONE)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            if self._error is None:
+                self._error = e
+            self._stop.set()
+
+    def __enter__(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __iter__(self):
+        try:
+            yield from self._drain(self._queues[-1])
+        except _Stopped:
+            pass
+        if self._error is not None:
+            raise self._error
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
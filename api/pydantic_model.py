@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 from enum import Enum
 from datetime import datetime
+from typing import List, Optional
 
 class ModelName(str, Enum):
     GPT4_O = "gpt-4o"
@@ -15,15 +16,46 @@ class QueryResponse(BaseModel):
     answer: str
     session_id: str
     model: ModelName
+    cached: bool = False      # served from the semantic answer cache
+    verbatim: bool = False    # a corpus snippet returned word-for-word, without the LLM
+
+class ChatTurn(BaseModel):
+    role: str           # "human" or "ai"
+    content: str
+
+class BatchQuestion(BaseModel):
+    question: str
+    session_id: Optional[str] = None
+    # Used instead of the stored history of session_id, e.g. for evaluation transcripts
+    history: Optional[List[ChatTurn]] = None
+
+class BatchQueryInput(BaseModel):
+    questions: List[BatchQuestion]
+    model: ModelName = Field(default=ModelName.GPT4_O_MINI)
 
 class DocumentInfo(BaseModel):
     id: int
     filename: str
     upload_timestamp: datetime
+    status: str = "indexed"
+    chunk_count: Optional[int] = None       # chunks in Chroma when indexed (0: no text)
+
+class IngestJobInfo(BaseModel):
+    job_id: str
+    file_id: int
+    filename: str
+    status: str
+    stage: str
+    chunks_done: int
+    chunks_total: int
+    error: Optional[str] = None
 
 class DeleteFileRequest(BaseModel):
     file_id: int
 
+class DeleteFilesRequest(BaseModel):
+    file_ids: List[int]
+
 class FeedbackModel(BaseModel):
     session_id: str
     user_query: str
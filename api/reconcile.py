@@ -0,0 +1,62 @@
+# Finds documents that exist on only one side of document_store / the Chroma collection
+# and repairs them:
+#   - chunks whose file_id has no document_store row are deleted from Chroma
+#   - "indexed" rows with no chunks in Chroma are marked "failed" so they can be re-uploaded,
+#     if they were indexed with chunks. A document without any text (e.g. a scanned PDF)
+#     is recorded with chunk_count 0 and left alone; rows indexed before chunk_count was
+#     recorded are only reported, as it is unknown whether they had chunks.
+#
+#   python reconcile.py [--dry-run]
+#
+# The same check is available on the API as POST /reconcile.
+import argparse
+import sys
+
+from db_utils import get_all_documents, update_document_status
+
+
+def reconcile(repair=True):
+    from chroma_utils import chroma_chunk_counts, delete_docs_from_chroma
+
+    chunks = chroma_chunk_counts()
+    records = {doc["id"]: doc for doc in get_all_documents()}
+    orphan_chunks = {file_id: n for file_id, n in chunks.items() if file_id is not None and file_id not in records}
+    # pending/indexing rows are still being written by an ingest job
+    without_chunks = [doc for file_id, doc in sorted(records.items())
+                      if doc["status"] == "indexed" and file_id not in chunks]
+    empty_records = [doc["id"] for doc in without_chunks if doc["chunk_count"]]
+    unverified = [doc["id"] for doc in without_chunks if doc["chunk_count"] is None]
+
+    repaired = False
+    if repair:
+        repaired = not orphan_chunks or delete_docs_from_chroma(sorted(orphan_chunks))
+        for file_id in empty_records:
+            update_document_status(file_id, "failed")
+    return {
+        "documents": len(records),
+        "files_in_chroma": len(chunks),
+        "orphan_chunks": orphan_chunks,         # file_id -> chunk count
+        "records_without_chunks": empty_records,
+        "unverified_records": unverified,        # indexed before chunk counts were recorded
+        "repaired": repaired,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile document_store with the Chroma collection.")
+    parser.add_argument("--dry-run", action="store_true", help="report orphans without repairing them")
+    args = parser.parse_args(argv)
+
+    report = reconcile(repair=not args.dry_run)
+    print(f"{report['documents']} documents, {report['files_in_chroma']} files in Chroma")
+    print(f"Chunks without a document record: {report['orphan_chunks'] or 'none'}")
+    print(f"Indexed records without chunks: {report['records_without_chunks'] or 'none'}")
+    if report["unverified_records"]:
+        print(f"Records without chunks and without a recorded chunk count (re-upload if they "
+              f"should have text): {report['unverified_records']}")
+    if report["repaired"]:
+        print("Repaired")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
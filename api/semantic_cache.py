@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+
+from chroma_utils import get_embedding_function, get_corpus_version
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))   # cosine similarity
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))                # seconds
+
+
+class SemanticCache:
+    # Answers keyed by the embedding of the standalone question. Vectors live in one
+    # preallocated matrix so a lookup is a single matrix-vector product; entries are
+    # evicted least-recently-used first, expire after ttl seconds, and the whole cache
+    # is dropped when the corpus version changes.
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_SIZE,
+                 ttl=SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._vectors = None                    # (max_entries, dim), allocated on first store
+        self._entries = OrderedDict()           # slot -> (model, question, answer, stored_at), LRU order
+        self._free = list(range(max_entries))
+        self._corpus_version = get_corpus_version()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_corpus(self):
+        version = get_corpus_version()
+        if version != self._corpus_version:
+            self._entries.clear()
+            self._free = list(range(self.max_entries))
+            self._corpus_version = version
+
+    def _drop(self, slot):
+        del self._entries[slot]
+        self._free.append(slot)
+
+    def lookup(self, vector, model):
+        with self._lock:
+            self._check_corpus()
+            if not self._entries:
+                self.misses += 1
+                return None
+            scores = self._vectors @ self._normalize(vector)
+            candidates = np.flatnonzero(scores >= self.threshold)
+            now = time.time()
+            for slot in candidates[np.argsort(-scores[candidates])]:
+                entry = self._entries.get(int(slot))
+                if entry is None:
+                    continue
+                if now - entry[3] > self.ttl:
+                    self._drop(int(slot))
+                    continue
+                if entry[0] == model:
+                    self._entries.move_to_end(int(slot))
+                    self.hits += 1
+                    return entry[2]
+            self.misses += 1
+            return None
+
+    def store(self, vector, model, question, answer, corpus_version=None):
+        # corpus_version: the version the answer was generated from; an answer that
+        # predates a corpus change is not stored
+        vector = self._normalize(vector)
+        with self._lock:
+            self._check_corpus()
+            if corpus_version is not None and corpus_version != self._corpus_version:
+                return
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            if not self._free:
+                oldest, _ = self._entries.popitem(last=False)
+                self._free.append(oldest)
+            slot = self._free.pop()
+            self._vectors[slot] = vector
+            self._entries[slot] = (model, question, answer, time.time())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._free = list(range(self.max_entries))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+semantic_cache = SemanticCache()
+
+
+class CacheKey(NamedTuple):
+    # What store_answer needs: the question embedding and the corpus version seen before
+    # retrieval, so an answer generated while the corpus changed is not cached as current
+    vector: list
+    corpus_version: int
+
+
+def cache_key(vector):
+    return CacheKey(vector, get_corpus_version())
+
+
+async def lookup_answer(standalone_question, model):
+    # Returns (cached answer or None, cache key to pass to store_answer). On a miss the
+    # key's vector is reused for retrieval, so the question is embedded only once.
+    if not SEMANTIC_CACHE_ENABLED:
+        return None, None
+    version = get_corpus_version()
+    vector = await get_embedding_function().aembed_query(standalone_question)
+    return semantic_cache.lookup(vector, model), CacheKey(vector, version)
+
+
+def store_answer(key, model, standalone_question, answer):
+    if SEMANTIC_CACHE_ENABLED and key is not None and answer:
+        semantic_cache.store(key.vector, model, standalone_question, answer, corpus_version=key.corpus_version)
@@ -0,0 +1,52 @@
+import asyncio
+import hashlib
+import json
+import os
+
+from chroma_utils import get_corpus_version
+from metrics import COALESCED_REQUESTS
+
+CHAT_COALESCING = os.getenv("CHAT_COALESCING", "1") == "1"
+
+
+def coalesce_key(question, model, chat_history):
+    # Requests are identical when they ask the same question (ignoring case and spacing)
+    # of the same model with the same history, against the same corpus
+    history = hashlib.sha256(json.dumps(chat_history, sort_keys=True).encode()).hexdigest()
+    return " ".join(question.lower().split()), model, history, get_corpus_version()
+
+
+class SingleFlight:
+    # In-flight request coalescing: the first request for a key leads and does the work;
+    # identical requests arriving meanwhile wait for its result instead of starting their
+    # own. A leader that fails or is abandoned publishes None, and its followers then
+    # answer for themselves. Lives on the event loop, so no locking is needed.
+
+    def __init__(self):
+        self._flights = {}
+
+    def join(self, key):
+        # The flight to wait for, or None when this request should lead
+        if not CHAT_COALESCING:
+            return None
+        return self._flights.get(key)
+
+    def lead(self, key):
+        future = asyncio.get_running_loop().create_future()
+        if CHAT_COALESCING:
+            self._flights[key] = future
+        return future
+
+    def land(self, key, future, result=None):
+        if self._flights.get(key) is future:
+            del self._flights[key]
+        if not future.done():
+            future.set_result(result)
+
+    async def wait(self, future, endpoint):
+        COALESCED_REQUESTS.labels(endpoint).inc()
+        # Shielded: a follower that disconnects must not cancel the shared result
+        return await asyncio.shield(future)
+
+
+single_flight = SingleFlight()
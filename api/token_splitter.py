@@ -0,0 +1,87 @@
+from bisect import bisect_left
+from typing import List
+
+from langchain_text_splitters import TextSplitter
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", ".", "!", "?", ",", " "]
+
+
+class TokenOffsetSplitter(TextSplitter):
+    # Token-aware splitter that tokenizes each text exactly once.
+    #
+    # RecursiveCharacterTextSplitter with a tiktoken length_function re-encodes every
+    # candidate merge, which is quadratic in page length. Here the page is encoded once,
+    # token start offsets give the token count of any character range by bisection, and
+    # each chunk ends at the last (highest-priority) separator that keeps it within
+    # chunk_size tokens. As in the recursive splitter, the separator starts the next
+    # chunk, and the overlap is made of whole separator-delimited pieces of at most
+    # chunk_overlap tokens. Token counts are those of the full page, which can differ by a
+    # token from re-encoding a chunk on its own at the boundaries.
+
+    def __init__(self, encoding, separators: List[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self._encoding = encoding
+        self._separators = separators or DEFAULT_SEPARATORS
+        self._token_chars = {}      # token id -> (chars it starts, 1 if it starts mid-character)
+
+    def _token_offsets(self, tokens):
+        # Char offset where each token starts; equivalent to Encoding.decode_with_offsets
+        # but several times faster because per-token byte facts are cached by token id.
+        offsets, chars = [], 0
+        token_chars = self._token_chars
+        for token in tokens:
+            info = token_chars.get(token)
+            if info is None:
+                data = self._encoding.decode_single_token_bytes(token)
+                info = token_chars[token] = (
+                    sum(1 for byte in data if not 0x80 <= byte < 0xC0),
+                    1 if data and 0x80 <= data[0] < 0xC0 else 0,
+                )
+            offsets.append(chars - info[1])
+            chars += info[0]
+        return offsets
+
+    def split_text(self, text: str) -> List[str]:
+        tokens = self._encoding.encode(text, disallowed_special=())
+        if not tokens:
+            return []
+        bounds = self._token_offsets(tokens) + [len(text)]     # bounds[i] = char offset of token i
+        n_tokens = len(tokens)
+
+        def token_at(pos):
+            # index of the first token starting at or after char pos
+            return bisect_left(bounds, pos)
+
+        chunks = []
+        start = 0
+        while start < len(text):
+            start_token = token_at(start)
+            limit_token = min(start_token + self._chunk_size, n_tokens)
+            limit = bounds[limit_token]
+            end, separator = limit, None
+            if limit_token < n_tokens:
+                end, separator = self._cut(text, start, limit)
+            chunk = text[start:end].strip() if self._strip_whitespace else text[start:end]
+            if chunk:
+                chunks.append(chunk)
+            if limit_token >= n_tokens and end == limit:
+                break
+            start = self._overlap_start(text, bounds, start_token, token_at(end), end, separator)
+        return chunks
+
+    def _cut(self, text, start, limit):
+        # Last occurrence of the highest-priority separator that fits in the window
+        for separator in self._separators:
+            pos = text.rfind(separator, start + 1, min(len(text), limit + len(separator)))
+            if pos != -1 and pos <= limit:
+                return pos, separator
+        return limit, None
+
+    def _overlap_start(self, text, bounds, start_token, end_token, end, separator):
+        if self._chunk_overlap <= 0:
+            return end
+        lo = bounds[max(end_token - self._chunk_overlap, start_token + 1)]
+        if separator is None:
+            return min(lo, end)
+        pos = text.find(separator, lo, end)
+        return end if pos == -1 else pos
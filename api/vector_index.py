@@ -0,0 +1,267 @@
+import json
+import os
+import threading
+import uuid
+from typing import List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(os.path.dirname(__file__), "vector_index"))
+# text-embedding-3 models are Matryoshka-trained: a renormalized prefix of the vector is
+# itself a usable (coarser) embedding, so the first pass only reads prefix_dim columns.
+VECTOR_INDEX_PREFIX_DIM = int(os.getenv("VECTOR_INDEX_PREFIX_DIM", "256"))
+VECTOR_INDEX_SHORTLIST = int(os.getenv("VECTOR_INDEX_SHORTLIST", "100"))
+# float16 halves the on-disk/mapped size of the full vectors, int8 quarters it
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float16")
+
+
+# save() compacts the segments into one once more than this share of rows is deleted, or
+# there are more than this many segments
+VECTOR_INDEX_COMPACT_RATIO = float(os.getenv("VECTOR_INDEX_COMPACT_RATIO", "0.25"))
+VECTOR_INDEX_MAX_SEGMENTS = int(os.getenv("VECTOR_INDEX_MAX_SEGMENTS", "16"))
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+class MatryoshkaIndex:
+    # In-memory alternative to Chroma's HNSW search for small corpora. Full vectors are
+    # kept as float16 (or int8) matrices memory-mapped from disk; a float32 copy of the
+    # normalized prefix columns stays resident. Search scores every chunk on the prefix, then
+    # reranks the shortlist on the full vectors.
+    #
+    # Writes append to an in-memory tail and deletes are tombstones. On disk the index is
+    # a set of immutable segment files ("<name>.npy" rows, "<name>.scales.npy") and
+    # manifest.json, which lists the segments with the ids and tombstones. save() writes
+    # the tail as a new segment and then replaces the manifest, so the switch to the new
+    # version is a single atomic step and no memory-mapped file is ever overwritten.
+    # Segments are compacted into one when too many rows are deleted or there are too
+    # many of them; files the manifest no longer names are removed once unmapped here
+    # (another process may still have them open, e.g. on Windows: they are retried on
+    # the next save).
+
+    def __init__(self, path=VECTOR_INDEX_DIR, prefix_dim=VECTOR_INDEX_PREFIX_DIM,
+                 shortlist=VECTOR_INDEX_SHORTLIST, dtype=VECTOR_INDEX_DTYPE):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported vector index dtype: {dtype}")
+        self.path = path
+        self.prefix_dim = prefix_dim
+        self.shortlist = shortlist
+        self.dtype = dtype
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self, segments=(), ids=(), file_ids=(), scales=None, deleted=None):
+        self._segments = list(segments)         # saved (name, (n_i, dim) memory-mapped rows)
+        self._tail = None                       # full rows added since the last save
+        self._ids = list(ids)
+        self._file_ids = list(file_ids)
+        self._deleted = np.zeros(len(self._ids), dtype=bool) if deleted is None else deleted
+        self._row = {chunk_id: i for i, chunk_id in enumerate(self._ids) if not self._deleted[i]}
+        self._scales = scales                   # per-row int8 dequantization factors
+        self._prefix = (_normalize(self._decode(
+            np.concatenate([rows[:, :self.prefix_dim] for _, rows in self._segments]), scales))
+            if self._segments else None)
+
+    def _encode(self, full):
+        # Returns (stored rows, per-row scales); int8 rows are quantized against their own max
+        if self.dtype == "int8":
+            scales = np.abs(full).max(axis=1) / 127
+            scales[scales == 0] = 1
+            return np.round(full / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return full.astype(np.float16), np.ones(len(full), dtype=np.float32)
+
+    def _decode(self, rows, scales):
+        return rows.astype(np.float32) * scales[:, None]
+
+    def __len__(self):
+        return len(self._ids) - int(self._deleted.sum())
+
+    @property
+    def _manifest_file(self):
+        return os.path.join(self.path, "manifest.json")
+
+    def _segment_files(self, name):
+        return os.path.join(self.path, f"{name}.npy"), os.path.join(self.path, f"{name}.scales.npy")
+
+    def _open_segment(self, name):
+        rows_file, scales_file = self._segment_files(name)
+        return np.load(rows_file, mmap_mode="r"), np.load(scales_file)
+
+    def _write_segment(self, rows, scales):
+        name = uuid.uuid4().hex
+        for file, array in zip(self._segment_files(name), (rows, scales)):
+            np.save(file + ".tmp.npy", array)
+            os.replace(file + ".tmp.npy", file)
+        return name
+
+    def load(self):
+        if not os.path.exists(self._manifest_file):
+            return False
+        try:
+            with open(self._manifest_file) as f:
+                manifest = json.load(f)
+            if manifest.get("prefix_dim") != self.prefix_dim or manifest.get("dtype") != self.dtype:
+                return False
+            opened = [(entry, self._open_segment(entry["name"])) for entry in manifest["segments"]]
+        except (OSError, ValueError) as e:
+            # e.g. a segment compacted away by the writer since the manifest was read
+            print(f"Could not load the vector index: {e}")
+            return False
+        if (any(len(rows) != entry["rows"] or len(scales) != entry["rows"] for entry, (rows, scales) in opened)
+                or sum(entry["rows"] for entry in manifest["segments"]) != len(manifest["ids"])):
+            return False
+        deleted = np.zeros(len(manifest["ids"]), dtype=bool)
+        deleted[manifest["deleted"]] = True
+        scales = np.concatenate([scales for _, (_, scales) in opened]) if opened else None
+        with self._lock:
+            self._reset([(entry["name"], rows) for entry, (rows, _) in opened],
+                        manifest["ids"], manifest["file_ids"], scales, deleted)
+        return True
+
+    def save(self):
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            segments = len(self._segments) + (self._tail is not None)
+            if (self._deleted.sum() > VECTOR_INDEX_COMPACT_RATIO * len(self._ids)
+                    or segments > VECTOR_INDEX_MAX_SEGMENTS):
+                self._compact()
+            elif self._tail is not None:
+                # Only the rows added since the last save are written
+                saved = len(self._ids) - len(self._tail)
+                name = self._write_segment(self._tail, self._scales[saved:])
+                self._segments.append((name, self._open_segment(name)[0]))
+                self._tail = None
+            manifest = {
+                "segments": [{"name": name, "rows": len(rows)} for name, rows in self._segments],
+                "ids": self._ids,
+                "file_ids": self._file_ids,
+                "deleted": np.flatnonzero(self._deleted).tolist(),
+                "prefix_dim": self.prefix_dim,
+                "dtype": self.dtype,
+            }
+            with open(self._manifest_file + ".tmp", "w") as f:
+                json.dump(manifest, f)
+            os.replace(self._manifest_file + ".tmp", self._manifest_file)
+            self._remove_unused_files()
+
+    def _compact(self):
+        keep = np.flatnonzero(~self._deleted)
+        ids = [self._ids[i] for i in keep]
+        file_ids = [self._file_ids[i] for i in keep]
+        if not len(keep):
+            self._reset()
+            return
+        scales = self._scales[keep]
+        name = self._write_segment(self._rows(keep), scales)
+        # Drops the references to the old memory maps before their files are removed
+        self._reset([(name, self._open_segment(name)[0])], ids, file_ids, scales)
+
+    def _remove_unused_files(self):
+        # Segments no longer in the manifest, and the files of the pre-manifest layout
+        used = {name for name, _ in self._segments}
+        for file in os.listdir(self.path):
+            if file.startswith("manifest.json") or file.split(".")[0] in used:
+                continue
+            try:
+                os.remove(os.path.join(self.path, file))
+            except OSError:
+                pass
+
+    def rebuild(self, collection, batch_size=1000, save=True):
+        # Reads every embedding back out of the Chroma collection
+        with self._lock:
+            self._reset()
+            total = collection.count()
+            for offset in range(0, total, batch_size):
+                data = collection.get(include=["embeddings", "metadatas"], limit=batch_size, offset=offset)
+                self.add(data["ids"], data["embeddings"], [m.get("file_id") for m in data["metadatas"]])
+            if save:
+                self.save()
+
+    def _rows(self, rows):
+        # Stored (encoded) full-dimension vectors for the given row numbers
+        rows = np.asarray(rows, dtype=np.int64)
+        parts = [segment for _, segment in self._segments] + ([self._tail] if self._tail is not None else [])
+        starts = np.cumsum([0] + [len(part) for part in parts])
+        which = np.searchsorted(starts, rows, side="right") - 1
+        if len(rows) and (which == which[0]).all():
+            return np.asarray(parts[which[0]][rows - starts[which[0]]])
+        out = np.empty((len(rows), parts[0].shape[1]), dtype=parts[0].dtype)
+        for part in np.unique(which):
+            mask = which == part
+            out[mask] = parts[part][rows[mask] - starts[part]]
+        return out
+
+    def add(self, ids, embeddings, file_ids):
+        full = _normalize(np.asarray(embeddings, dtype=np.float32))
+        prefix = _normalize(full[:, :self.prefix_dim])
+        with self._lock:
+            self.remove([chunk_id for chunk_id in ids if chunk_id in self._row])
+            start = len(self._ids)
+            encoded, scales = self._encode(full)
+            self._tail = encoded if self._tail is None else np.concatenate([self._tail, encoded])
+            self._scales = scales if self._scales is None else np.concatenate([self._scales, scales])
+            self._prefix = prefix if self._prefix is None else np.concatenate([self._prefix, prefix])
+            self._ids.extend(ids)
+            self._file_ids.extend(file_ids)
+            self._row.update((chunk_id, start + i) for i, chunk_id in enumerate(ids))
+            self._deleted = np.concatenate([self._deleted, np.zeros(len(ids), dtype=bool)])
+
+    def remove(self, ids):
+        with self._lock:
+            for chunk_id in ids:
+                row = self._row.pop(chunk_id, None)
+                if row is not None:
+                    self._deleted[row] = True
+
+    def remove_file(self, file_id):
+        with self._lock:
+            self.remove([cid for cid, fid in zip(self._ids, self._file_ids) if fid == file_id])
+
+    def search(self, query_vector, k=3):
+        query = _normalize(np.asarray(query_vector, dtype=np.float32))
+        with self._lock:
+            if not len(self):
+                return []
+            coarse = self._prefix @ _normalize(query[:self.prefix_dim])
+            coarse[self._deleted] = -np.inf
+            m = min(max(self.shortlist, k), len(self))
+            shortlist = np.argpartition(-coarse, m - 1)[:m]
+            fine = self._decode(self._rows(shortlist), self._scales[shortlist]) @ query
+            order = np.argsort(-fine)[:k]
+            return [(self._ids[shortlist[i]], float(fine[i])) for i in order]
+
+
+class MatryoshkaRetriever(BaseRetriever):
+    # Vector retriever backed by MatryoshkaIndex; chunk text and metadata come from Chroma
+    index: MatryoshkaIndex
+    embeddings: Embeddings
+    collection: object
+    k: int = 3
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.search_by_vector(self.embeddings.embed_query(query))
+
+    def search_by_vector(self, vector):
+        return self.search_by_vectors([vector])[0]
+
+    def search_by_vectors(self, vectors):
+        # Text and metadata for all the queries' hits come from one Chroma read
+        hits = [self.index.search(vector, self.k) for vector in vectors]
+        ids = list({chunk_id for query_hits in hits for chunk_id, _ in query_hits})
+        if not ids:
+            return [[] for _ in hits]
+        data = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        found = {cid: (text, meta) for cid, text, meta in zip(data["ids"], data["documents"], data["metadatas"])}
+        return [[Document(page_content=found[cid][0], metadata=found[cid][1] or {}, id=cid)
+                 for cid, _ in query_hits if cid in found] for query_hits in hits]
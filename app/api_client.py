@@ -0,0 +1,264 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Where the FastAPI backend runs
+RAG_API_URL = os.getenv("RAG_API_URL", "http://localhost:8000").rstrip("/")
+# (connect, read) timeouts in seconds; chat answers can take a while to generate
+API_CONNECT_TIMEOUT = float(os.getenv("RAG_API_CONNECT_TIMEOUT", "3"))
+API_READ_TIMEOUT = float(os.getenv("RAG_API_READ_TIMEOUT", "30"))
+API_CHAT_TIMEOUT = float(os.getenv("RAG_API_CHAT_TIMEOUT", "180"))
+API_RETRIES = int(os.getenv("RAG_API_RETRIES", "3"))
+API_BACKOFF = float(os.getenv("RAG_API_BACKOFF", "0.3"))        # seconds, doubled per retry
+LIST_DOCS_TTL = float(os.getenv("RAG_LIST_DOCS_TTL", "5"))
+
+# Busy or restarting backends; 429/503 responses may carry Retry-After
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class ApiError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _check(response):
+    if response.status_code >= 400:
+        raise ApiError(f"{response.status_code} - {response.text}", response.status_code)
+    return response
+
+
+def _chat_payload(question, session_id, model):
+    data = {"question": question, "model": model}
+    if session_id:
+        data["session_id"] = session_id
+    return data
+
+
+def _batch_payload(questions, model):
+    # Plain strings, or dicts with "question" and optionally "session_id" / "history"
+    return {"model": model, "questions": [q if isinstance(q, dict) else {"question": q} for q in questions]}
+
+
+class _TTLCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._value = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, load):
+        with self._lock:
+            if self._value is None or time.monotonic() >= self._expires:
+                self._value = load()
+                self._expires = time.monotonic() + self.ttl
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+
+
+class ApiClient:
+    # Synchronous client with a keep-alive connection pool. Idempotent GETs are retried
+    # with exponential backoff on connection errors and busy responses; POSTs are only
+    # retried when the connection could not be established (nothing was sent).
+
+    def __init__(self, base_url=RAG_API_URL, retries=API_RETRIES, backoff=API_BACKOFF, pool_size=10):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff,
+                      status_forcelist=RETRY_STATUSES, allowed_methods=frozenset({"GET"}),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._documents = _TTLCache(LIST_DOCS_TTL)
+
+    def _request(self, method, path, read_timeout=API_READ_TIMEOUT, **kwargs):
+        kwargs.setdefault("timeout", (API_CONNECT_TIMEOUT, read_timeout))
+        return _check(self.session.request(method, f"{self.base_url}{path}", **kwargs))
+
+    def chat(self, question, session_id=None, model="gpt-4o-mini"):
+        return self._request("POST", "/chat", API_CHAT_TIMEOUT,
+                             json=_chat_payload(question, session_id, model)).json()
+
+    def stream_chat(self, question, session_id=None, model="gpt-4o-mini"):
+        # Yields the NDJSON events of /chat/stream as dicts ("start", "token", "end", "error")
+        with self._request("POST", "/chat/stream", API_CHAT_TIMEOUT, stream=True,
+                           json=_chat_payload(question, session_id, model)) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield json.loads(line)
+
+    def chat_batch(self, questions, model="gpt-4o-mini"):
+        # Yields the NDJSON events of /chat/batch: "start", then "result" | "error" as answers complete, then "end"
+        with self._request("POST", "/chat/batch", API_CHAT_TIMEOUT, stream=True,
+                           json=_batch_payload(questions, model)) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield json.loads(line)
+
+    def upload_document(self, filename, content, content_type=None):
+        result = self._request("POST", "/upload-doc", API_CHAT_TIMEOUT,
+                               files={"file": (filename, content, content_type)}).json()
+        self._documents.invalidate()
+        return result
+
+    def job_status(self, job_id):
+        return self._request("GET", f"/jobs/{job_id}").json()
+
+    def list_documents(self, fresh=False):
+        if fresh:
+            self._documents.invalidate()
+        return self._documents.get(lambda: self._request("GET", "/list-docs").json())
+
+    def delete_document(self, file_id):
+        result = self._request("POST", "/delete-doc", json={"file_id": file_id}).json()
+        self._documents.invalidate()
+        return result
+
+    def delete_documents(self, file_ids):
+        result = self._request("POST", "/delete-docs", json={"file_ids": list(file_ids)}).json()
+        self._documents.invalidate()
+        return result
+
+    def send_feedback(self, session_id, user_query, model_response, feedback):
+        return self._request("POST", "/log-feedback", json={
+            "session_id": session_id,
+            "user_query": user_query,
+            "model_response": model_response,
+            "feedback": feedback,
+        }).json()
+
+    def check_user(self, name, email, phone):
+        return self._request("POST", "/check-user", json={"name": name, "email": email, "phone": phone}).json()["allowed"]
+
+    def log_user(self, name, email, phone):
+        return self._request("POST", "/log-user", json={"name": name, "email": email, "phone": phone}).json()
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncApiClient:
+    # asyncio counterpart of ApiClient, with the same methods (aclose instead of close),
+    # built on a pooled httpx.AsyncClient for callers that fan out many requests at once
+    # (e.g. load tests or batch scripts)
+
+    def __init__(self, base_url=RAG_API_URL, retries=API_RETRIES, backoff=API_BACKOFF, pool_size=20):
+        import httpx
+        self._httpx = httpx
+        self.retries = retries
+        self.backoff = backoff
+        self.client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(API_READ_TIMEOUT, connect=API_CONNECT_TIMEOUT),
+        )
+        self._documents = None
+        self._documents_expires = 0.0
+
+    async def _request(self, method, path, read_timeout=API_READ_TIMEOUT, **kwargs):
+        timeout = self._httpx.Timeout(read_timeout, connect=API_CONNECT_TIMEOUT)
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.request(method, path, timeout=timeout, **kwargs)
+            except self._httpx.ConnectError:
+                if attempt == self.retries:
+                    raise
+            except self._httpx.TransportError:
+                if method != "GET" or attempt == self.retries:
+                    raise
+            else:
+                if method != "GET" or response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return _check(response)
+                retry_after = response.headers.get("retry-after", "")
+                if retry_after.isdigit():
+                    await asyncio.sleep(int(retry_after))
+                    continue
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def chat(self, question, session_id=None, model="gpt-4o-mini"):
+        response = await self._request("POST", "/chat", API_CHAT_TIMEOUT,
+                                       json=_chat_payload(question, session_id, model))
+        return response.json()
+
+    async def stream_chat(self, question, session_id=None, model="gpt-4o-mini"):
+        timeout = self._httpx.Timeout(API_CHAT_TIMEOUT, connect=API_CONNECT_TIMEOUT)
+        async with self.client.stream("POST", "/chat/stream", timeout=timeout,
+                                      json=_chat_payload(question, session_id, model)) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                _check(response)
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+    async def chat_batch(self, questions, model="gpt-4o-mini"):
+        timeout = self._httpx.Timeout(API_CHAT_TIMEOUT, connect=API_CONNECT_TIMEOUT)
+        async with self.client.stream("POST", "/chat/batch", timeout=timeout,
+                                      json=_batch_payload(questions, model)) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                _check(response)
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+    async def upload_document(self, filename, content, content_type=None):
+        response = await self._request("POST", "/upload-doc", API_CHAT_TIMEOUT,
+                                       files={"file": (filename, content, content_type)})
+        self._documents = None
+        return response.json()
+
+    async def job_status(self, job_id):
+        return (await self._request("GET", f"/jobs/{job_id}")).json()
+
+    async def list_documents(self, fresh=False):
+        if fresh or self._documents is None or time.monotonic() >= self._documents_expires:
+            self._documents = (await self._request("GET", "/list-docs")).json()
+            self._documents_expires = time.monotonic() + LIST_DOCS_TTL
+        return self._documents
+
+    async def delete_document(self, file_id):
+        response = await self._request("POST", "/delete-doc", json={"file_id": file_id})
+        self._documents = None
+        return response.json()
+
+    async def delete_documents(self, file_ids):
+        response = await self._request("POST", "/delete-docs", json={"file_ids": list(file_ids)})
+        self._documents = None
+        return response.json()
+
+    async def send_feedback(self, session_id, user_query, model_response, feedback):
+        response = await self._request("POST", "/log-feedback", json={
+            "session_id": session_id,
+            "user_query": user_query,
+            "model_response": model_response,
+            "feedback": feedback,
+        })
+        return response.json()
+
+    async def check_user(self, name, email, phone):
+        response = await self._request("POST", "/check-user", json={"name": name, "email": email, "phone": phone})
+        return response.json()["allowed"]
+
+    async def log_user(self, name, email, phone):
+        response = await self._request("POST", "/log-user", json={"name": name, "email": email, "phone": phone})
+        return response.json()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
@@ -1,76 +1,92 @@
 import requests
 import streamlit as st
+from api_client import ApiClient, ApiError
 
-def get_api_response(question, session_id, model):
-    headers = {'accept': 'application/json', 'Content-Type': 'application/json'}
-    data = {"question": question, "model": model}
-    if session_id:
-        data["session_id"] = session_id
+# One pooled client per Streamlit server process, shared by every session and rerun
+@st.cache_resource
+def get_client():
+    return ApiClient()
 
+def get_api_response(question, session_id, model):
     try:
-        response = requests.post("http://localhost:8000/chat", headers=headers, json=data)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"API request failed with status code {response.status_code}: {response.text}")
-            return None
+        return get_client().chat(question, session_id, model)
+    except ApiError as e:
+        st.error(f"API request failed with status code {e}")
+        return None
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
         return None
 
+def stream_api_response(question, session_id, model):
+    # Yields the NDJSON events of /chat/stream as dicts ("start", "token", "end", "error")
+    try:
+        yield from get_client().stream_chat(question, session_id, model)
+    except ApiError as e:
+        st.error(f"API request failed with status code {e}")
+    except Exception as e:
+        st.error(f"An error occurred: {str(e)}")
+
 def upload_document(file):
     try:
-        files = {"file": (file.name, file, file.type)}
-        response = requests.post("http://localhost:8000/upload-doc", files=files)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"Failed to upload file. Error: {response.status_code} - {response.text}")
-            return None
+        return get_client().upload_document(file.name, file, file.type)
+    except ApiError as e:
+        st.error(f"Failed to upload file. Error: {e}")
+        return None
     except Exception as e:
         st.error(f"An error occurred while uploading the file: {str(e)}")
         return None
 
-def list_documents():
+def get_job_status(job_id):
+    try:
+        return get_client().job_status(job_id)
+    except ApiError as e:
+        st.error(f"Failed to fetch job status. Error: {e}")
+        return None
+    except Exception as e:
+        st.error(f"An error occurred while fetching the job status: {str(e)}")
+        return None
+
+def list_documents(fresh=False):
     try:
-        response = requests.get("http://localhost:8000/list-docs")
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"Failed to fetch document list. Error: {response.status_code} - {response.text}")
-            return []
-    except Exception as e: 
+        return get_client().list_documents(fresh=fresh)
+    except ApiError as e:
+        st.error(f"Failed to fetch document list. Error: {e}")
+        return []
+    except Exception as e:
         st.error(f"An error occurred while fetching the document list: {str(e)}")
         return []
 
 def delete_document(file_id):
-    headers = {'accept': 'application/json', 'Content-Type': 'application/json'}
-    data = {"file_id": file_id}
-
     try:
-        response = requests.post("http://localhost:8000/delete-doc", headers=headers, json=data)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"Failed to delete document. Error: {response.status_code} - {response.text}")
-            return None
+        return get_client().delete_document(file_id)
+    except ApiError as e:
+        st.error(f"Failed to delete document. Error: {e}")
+        return None
     except Exception as e:
         st.error(f"An error occurred while deleting the document: {str(e)}")
         return None
 
 ## capturing error block
 def send_feedback(session_id, user_query, model_response, feedback):
-    headers = {'accept': 'application/json', 'Content-Type': 'application/json'}
-    data = {
-        "session_id": session_id,
-        "user_query": user_query,
-        "model_response": model_response,
-        "feedback": feedback
-    }
-
     try:
-        response = requests.post("http://localhost:8000/log-feedback", headers=headers, json=data)
-        return response.status_code == 200
+        get_client().send_feedback(session_id, user_query, model_response, feedback)
+        return True
+    except ApiError:
+        return False
     except Exception as e:
         st.error(f"Error sending feedback: {str(e)}")
         return False
+
+def is_user_allowed(name, email, phone):
+    # None when the backend couldn't be asked, so the login can tell "denied" from "unreachable"
+    try:
+        return get_client().check_user(name, email, phone)
+    except (ApiError, requests.RequestException):
+        st.error("⚠️ Couldn't reach the backend to verify your access. Please try again.")
+        return None
+
+def log_user(name, email, phone):
+    try:
+        get_client().log_user(name, email, phone)
+    except (ApiError, requests.RequestException):
+        st.warning("⚠️ Couldn't connect to backend for user logging.")
@@ -1,12 +1,31 @@
 import streamlit as st
-from api_utils import get_api_response, send_feedback
+from api_utils import get_api_response, stream_api_response, send_feedback
 from PIL import Image
 
 # Load avatars
 user_avatar = Image.open("query_logo.jpg")           # e.g. a rectangular icon with 'Y' or 'YOU'
 assistant_avatar = Image.open("response_logo.jpg")  # e.g. RJ sir as AI icon
 
-def display_chat_interface():
+def stream_answer(prompt):
+    # Renders tokens as they arrive; returns the full answer (None if the request failed)
+    result = {}
+
+    def tokens():
+        for event in stream_api_response(prompt, st.session_state.session_id, st.session_state.model):
+            if event["type"] == "start":
+                st.session_state.session_id = event["session_id"]
+            elif event["type"] == "token":
+                yield event["content"]
+            elif event["type"] == "end":
+                result["answer"] = event["answer"]
+            elif event["type"] == "error":
+                st.error(f"An error occurred: {event['detail']}")
+
+    with st.chat_message("assistant", avatar=assistant_avatar):
+        st.write_stream(tokens())
+    return result.get("answer")
+
+def display_chat_interface(stream=False):
     # Show message history
     for message in st.session_state.messages:
         avatar = user_avatar if message["role"] == "user" else assistant_avatar
@@ -21,17 +40,23 @@ def display_chat_interface():
         with st.chat_message("user", avatar=user_avatar):
             st.markdown(prompt)
 
-        with st.spinner("Thinking..."):
-            response = get_api_response(prompt, st.session_state.session_id, st.session_state.model)
-
-            if response:
-                st.session_state.session_id = response.get("session_id")
-                answer = response["answer"]
+        if stream:
+            answer = stream_answer(prompt)
+            if answer:
                 st.session_state.last_answer = answer
                 st.session_state.messages.append({"role": "assistant", "content": answer})
+        else:
+            with st.spinner("Thinking..."):
+                response = get_api_response(prompt, st.session_state.session_id, st.session_state.model)
+
+                if response:
+                    st.session_state.session_id = response.get("session_id")
+                    answer = response["answer"]
+                    st.session_state.last_answer = answer
+                    st.session_state.messages.append({"role": "assistant", "content": answer})
 
-                with st.chat_message("assistant", avatar=assistant_avatar):
-                    st.markdown(answer)
+                    with st.chat_message("assistant", avatar=assistant_avatar):
+                        st.markdown(answer)
 
     # Feedback form
     if "last_answer" in st.session_state:
@@ -1,5 +1,21 @@
+import time
 import streamlit as st
-from api_utils import upload_document, list_documents, delete_document
+from api_utils import upload_document, get_job_status, list_documents, delete_document
+
+def wait_for_indexing(job_id):
+    # Polls the background ingestion job and mirrors its progress in the sidebar
+    bar = st.sidebar.progress(0, text="Queued for indexing...")
+    while True:
+        job = get_job_status(job_id)
+        if job is None:
+            return None
+        total = job["chunks_total"]
+        fraction = job["chunks_done"] / total if total else 0.0
+        bar.progress(fraction, text=f"{job['stage'].capitalize()}... {job['chunks_done']}/{total} chunks")
+        if job["status"] in ("indexed", "failed", "cancelled"):
+            bar.empty()
+            return job
+        time.sleep(1)
 
 def display_sidebar():
     # Model selection
@@ -11,19 +27,25 @@ def display_sidebar():
     if uploaded_file and st.sidebar.button("Upload"):
         with st.spinner("Uploading..."):
             upload_response = upload_document(uploaded_file)
-            if upload_response:
+        if upload_response and upload_response["job_id"] is None:
+            st.sidebar.info(f"{uploaded_file.name} is unchanged (ID {upload_response['file_id']}).")
+        elif upload_response:
+            job = wait_for_indexing(upload_response["job_id"])
+            if job and job["status"] == "indexed":
                 st.sidebar.success(f"File uploaded successfully with ID {upload_response['file_id']}.")
-                st.session_state.documents = list_documents()
+            elif job:
+                st.sidebar.error(f"Indexing {job['status']}: {job['error'] or 'no details'}")
+            st.session_state.documents = list_documents()
 
     # List and delete documents
     st.sidebar.header("Uploaded Documents")
     if st.sidebar.button("Refresh Document List"):
-        st.session_state.documents = list_documents()
+        st.session_state.documents = list_documents(fresh=True)
 
     # Display document list and delete functionality
     if "documents" in st.session_state and st.session_state.documents:
         for doc in st.session_state.documents:
-            st.sidebar.text(f"{doc['filename']} (ID: {doc['id']})")
+            st.sidebar.text(f"{doc['filename']} (ID: {doc['id']}, {doc.get('status', 'indexed')})")
 
         selected_file_id = st.sidebar.selectbox("Select a document to delete", 
                                                 options=[doc['id'] for doc in st.session_state.documents])
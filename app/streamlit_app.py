@@ -1,17 +1,7 @@
-import sys
-import os
-
-# Add the /api folder to Python path
-api_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "api"))
-sys.path.append(api_path)
-
 import streamlit as st
 from chat_interface import display_chat_interface
+from api_utils import is_user_allowed, log_user
 from PIL import Image
-import requests
-from db_utils import is_user_allowed
-
-#from db_utils import is_user_allowed 
 
 # ---------------- SESSION STATE INIT ---------------- #
 if "is_logged_in" not in st.session_state:
@@ -87,23 +77,17 @@ def show_login():
 
         if submit:
             if name and email and phone:
-                if is_user_allowed(name, email, phone):
+                allowed = is_user_allowed(name, email, phone)
+                if allowed:
                     st.session_state["is_logged_in"] = True
                     st.session_state["user_info"] = {
                         "name": name,
                         "email": email,
                         "phone": phone
                     }
-                    try:
-                        requests.post("http://localhost:8000/log-user", json={
-                            "name": name,
-                            "email": email,
-                            "phone": phone
-                        })
-                    except:
-                        st.warning("⚠️ Couldn't connect to backend for user logging.")
+                    log_user(name, email, phone)
                     st.success(f"✅ Welcome, {name}! You're now logged in.")
-                else:
+                elif allowed is False:
                     st.error("🚫 Access Denied: Your credentials were not found in our records.")
             else:
                 st.warning("🚫 Please fill in all fields.")
@@ -131,7 +115,7 @@ def run_main_app():
         st.session_state["model"] = "gpt-4o"  # Default model
 
     # Display the chat interface
-    display_chat_interface()
+    display_chat_interface(stream=True)
 
 # ---------------- ENTRY POINT ---------------- #
 if not st.session_state["is_logged_in"]: